@@ -0,0 +1,141 @@
+#!/usr/bin/python
+"""
+ Motion detection benchmark for picamera-motion.
+ Runs the MotionScanner.scan_motion loop against a frame source using
+ the settings.py threshold, sensitivity and stream size and reports
+ frames per second, per frame diff latency and detection to save latency.
+ The synthetic and replay sources need no camera so performance
+ regressions can be checked on any Linux computer.
+
+ Examples
+     ./benchmark.py                                 # synthetic frames
+     ./benchmark.py --source replay --path frames.npz
+     ./benchmark.py --source picamera --frames 300  # on a Raspberry Pi
+     ./benchmark.py --duty                          # with the duty cycle levels
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import motion.FrameSource as FrameSource
+import motion.MotionScanner as MotionScanner
+import motion.DutyCycleScheduler as DutyCycleScheduler
+import monitoring.Metrics as Metrics
+
+PROG_VER = "ver 1.0"
+SCRIPT_PATH = os.path.abspath(__file__)
+BASE_DIR = os.path.dirname(SCRIPT_PATH)
+PROG_NAME = os.path.basename(__file__)
+
+CONFIG_FILE_PATH = os.path.join(BASE_DIR, "settings.py")
+if not os.path.exists(CONFIG_FILE_PATH):
+    print("ERROR - Missing Configuration File %s" % CONFIG_FILE_PATH)
+    sys.exit(1)
+from settings import *
+import settings
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def print_latency(label, values):
+    """ Print latency statistics in milliseconds """
+    if not values:
+        print("%-18s no samples" % label)
+        return
+    print("%-18s mean %8.3f  p50 %8.3f  p95 %8.3f  max %8.3f ms  (n=%i)"
+          % (label, 1000.0 * sum(values) / len(values),
+             1000.0 * percentile(values, 50), 1000.0 * percentile(values, 95),
+             1000.0 * max(values), len(values)))
+
+
+def run_benchmark(source, max_frames, save_dir, duty=False):
+    """
+    Run MotionScanner.scan_motion, the loop picamera-motion.py uses, with
+    the settings.py engine, background and lighting filter and a timer
+    around each compare and each save. With duty the DutyCycleScheduler
+    paces the frames and scales the stream as it does with dutyCycleOn.
+    """
+    make_engine, background, lighting = MotionScanner.make_detector(settings)
+    metrics = Metrics.MetricsRegistry()
+    scanned = metrics.counter("frames_scanned_total")
+    diff_times = []
+    save_times = []
+    event_count = 0
+    with source:
+        scheduler = None
+        if duty:
+            scheduler = DutyCycleScheduler.DutyCycleScheduler(dutyLevels, source,
+                                                              make_engine,
+                                                              coarse_delta=dutyCoarseDelta,
+                                                              report_sec=dutyReportSec)
+        start_time = time.perf_counter()
+        for result in MotionScanner.scan_motion(source.frames(), make_engine(),
+                                                streamHeight, background,
+                                                metrics=metrics, scheduler=scheduler,
+                                                lighting=lighting,
+                                                diff_times=diff_times):
+            if result is not None:
+                detect_time = time.perf_counter()
+                event_count += 1
+                image_path = os.path.join(save_dir, "bench-%i.img" % event_count)
+                source.capture_still(image_path)
+                save_times.append(time.perf_counter() - detect_time)
+            if scanned.value >= max_frames:
+                break
+        elapsed = time.perf_counter() - start_time
+    return scanned.value, event_count, elapsed, diff_times, save_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="picamera-motion detection benchmark")
+    parser.add_argument("--source", default="synthetic",
+                        choices=["synthetic", "replay", "picamera"],
+                        help="frame source to benchmark (default synthetic)")
+    parser.add_argument("--path", default=frameSourcePath,
+                        help="replay folder, .npz or raw frame file")
+    parser.add_argument("--frames", type=int, default=1000,
+                        help="maximum number of frames to scan")
+    parser.add_argument("--duty", action="store_true",
+                        help="pace and scale frames with the settings.py dutyLevels")
+    args = parser.parse_args()
+
+    source = FrameSource.open_frame_source(args.source,
+                                           (imageWidth, imageHeight),
+                                           (streamWidth, streamHeight),
+                                           path=args.path,
+                                           vflip=imageVFlip, hflip=imageHFlip,
+                                           stream_format=streamFormat)
+    save_dir = tempfile.mkdtemp(prefix="picamera-motion-bench-")
+    try:
+        frame_count, event_count, elapsed, diff_times, save_times = run_benchmark(
+            source, args.frames, save_dir, duty=args.duty)
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    print("----------------------------------------------------------------")
+    print("%s %s" % (PROG_NAME, PROG_VER))
+    print("Source  - %s %s" % (args.source, args.path))
+    print("Stream  - %ix%i  threshold=%i  sensitivity=%i  background=%s  zones=%i  blocks=%s"
+          "  duty=%s"
+          % (streamWidth, streamHeight, threshold, sensitivity, motionBackgroundOn,
+             len(motionZones), motionBlockSize if motionBlockOn else "Off", args.duty))
+    print("----------------------------------------------------------------")
+    if elapsed > 0:
+        print("Frames  - %i in %.3f sec = %.1f frames/s"
+              % (frame_count, elapsed, frame_count / elapsed))
+    print("Events  - %i motion detections" % event_count)
+    print_latency("Diff latency", diff_times)
+    print_latency("Detect to save", save_times)
+    print("----------------------------------------------------------------")
+
+
+if __name__ == '__main__':
+    main()
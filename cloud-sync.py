@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""
+ Upload new images and clips to a cloud remote without listing the whole
+ archive on every run like rclone-sync.sh does. Files already uploaded
+ are kept in a sqlite manifest (cloudSyncManifest) so only new files are
+ sent, in batches with parallel transfers. An interrupted run carries on
+ where it stopped. A full compare with a remote listing (reconcile) runs
+ every cloudSyncReconcileHours hours.
+ Remote is set by cloudSyncRemote in settings.py. Use a folder path to try
+ it out against a local directory.
+
+     ./cloud-sync.py --once        # upload new files and exit (cron)
+     ./cloud-sync.py --reconcile   # same plus a compare with the remote
+     ./cloud-sync.py               # keep running. New files by inotify
+                                   # (pip3 install inotify_simple) or scan
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import storage.CloudSync as CloudSync
+import storage.StorageManager as StorageManager
+
+PROG_VER = "ver 1.0"
+SCRIPT_PATH = os.path.abspath(__file__)
+BASE_DIR = os.path.dirname(SCRIPT_PATH)
+PROG_NAME = os.path.basename(__file__)
+
+CONFIG_FILE_PATH = os.path.join(BASE_DIR, "settings.py")
+if not os.path.exists(CONFIG_FILE_PATH):
+    print("ERROR - Missing Configuration File %s" % CONFIG_FILE_PATH)
+    sys.exit(1)
+from settings import *
+# images are in RAM with imageStorageMode "tmpfs"
+imagePath = StorageManager.image_root(imagePath, imageStorageMode, imageTmpfsPath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental upload of imagePath")
+    parser.add_argument("--once", action="store_true",
+                        help="upload new files then exit")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="also list the remote and upload files missing there, then exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)-8s %(message)s")
+
+    if not os.path.isdir(imagePath):
+        print("ERROR - imagePath=%s Does Not Exist." % imagePath)
+        sys.exit(1)
+    remote = CloudSync.open_remote(cloudSyncRemote, transfers=cloudSyncTransfers)
+    manifest = CloudSync.SyncManifest(cloudSyncManifest)
+    sync = CloudSync.CloudSync(imagePath, remote, manifest,
+                               batch_size=cloudSyncBatch,
+                               interval_sec=cloudSyncIntervalSec,
+                               reconcile_sec=cloudSyncReconcileHours * 3600,
+                               skip_dirs=(thumbDir,))
+    print("%s %s  %s -> %s" % (PROG_NAME, PROG_VER, imagePath, cloudSyncRemote))
+    if args.once or args.reconcile:
+        queued = sync.reconcile() if args.reconcile else sync.scan()
+        synced = sync.sync_once()
+        print("%s Queued %i Synced %i Pending %i" % (PROG_NAME, queued, synced,
+                                                   manifest.pending_count()))
+        manifest.close()
+        return
+
+    watcher = None
+    if CloudSync.inotify_simple is not None:
+        watcher = CloudSync.InotifyWatcher(imagePath, sync.add, skip_dirs=(thumbDir,))
+    else:
+        print("inotify_simple Not Installed. Scanning %s every %i seconds"
+              % (imagePath, cloudSyncIntervalSec))
+    # systemctl stop ends the service like ctrl-c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    sync.start()
+    try:
+        while True:
+            if watcher is not None:
+                watcher.poll(cloudSyncIntervalSec)
+            else:
+                time.sleep(cloudSyncIntervalSec)
+                sync.scan()
+    except KeyboardInterrupt:
+        print("%s Stopping" % PROG_NAME)
+    finally:
+        sync.stop()
+        if watcher is not None:
+            watcher.close()
+        manifest.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ echo "INFO  : Install Dependencies ...."
 sudo apt-get install -yq python-imaging
 sudo apt-get install -yq python-picamera
 sudo apt-get install -yq python3-picamera
+sudo apt-get install -yq python3-pil    # gallery thumbnails
 sudo apt-get install -yq dos2unix
 sudo apt-get install -yq pandoc # convert markdown to plain text for Readme.md
 
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+"""
+ Move images saved in a flat imagePath folder into the date partitioned
+ layout set by storageLayout in settings.py (YYYY/MM/DD or YYYY/MM/DD/HH).
+ The partition of each file is taken from its modification time and the
+ sqlite image index is updated so the web listing keeps working.
+ Stop picamera-motion.py before running this.
+
+     ./migrate-storage.py --dry-run   # show what would be moved
+     ./migrate-storage.py
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import storage.ImageIndex as ImageIndex
+import storage.StorageManager as StorageManager
+
+PROG_VER = "ver 1.0"
+SCRIPT_PATH = os.path.abspath(__file__)
+BASE_DIR = os.path.dirname(SCRIPT_PATH)
+PROG_NAME = os.path.basename(__file__)
+
+CONFIG_FILE_PATH = os.path.join(BASE_DIR, "settings.py")
+if not os.path.exists(CONFIG_FILE_PATH):
+    print("ERROR - Missing Configuration File %s" % CONFIG_FILE_PATH)
+    sys.exit(1)
+from settings import *
+
+# files picamera-motion.py saves in imagePath (images and event clips)
+MEDIA_EXT = (".jpg", ".h264", ".npz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat images into date folders")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the moves")
+    args = parser.parse_args()
+
+    if storageLayout == "flat":
+        print("storageLayout is flat in settings.py. Nothing to do.")
+        return
+    manager = StorageManager.StorageManager(imagePath, layout=storageLayout)
+    index = None
+    if os.path.exists(imageIndexFile):
+        index = ImageIndex.ImageIndex(imageIndexFile)
+
+    moved = 0
+    for entry in sorted(os.listdir(imagePath)):
+        old_path = os.path.join(imagePath, entry)
+        if not entry.endswith(MEDIA_EXT) or not os.path.isfile(old_path):
+            continue
+        when = datetime.datetime.fromtimestamp(os.path.getmtime(old_path))
+        if args.dry_run:
+            new_path = os.path.join(manager.partition_path(when), entry)
+            print("%s -> %s" % (old_path, new_path))
+            moved += 1
+            continue
+        new_path = os.path.join(manager.partition_dir(when), entry)
+        if os.path.exists(new_path):
+            print("SKIP  - %s already exists" % new_path)
+            continue
+        os.rename(old_path, new_path)
+        if index is not None:
+            index.rename(entry, os.path.relpath(new_path, imagePath))
+        moved += 1
+    if index is not None:
+        index.close()
+    print("%s %s %s %i files in %s" % (PROG_NAME, PROG_VER,
+                                       "Would Move" if args.dry_run else "Moved",
+                                       moved, imagePath))
+
+
+if __name__ == '__main__':
+    main()
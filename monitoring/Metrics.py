@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from a fast numpy diff up to a slow ftp upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value) for key, value in labels) + "}"
+
+
+class Counter:
+    """ Value that only goes up """
+
+    def __init__(self, labels) -> None:
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        return [(name, self.labels, self.value)]
+
+
+class Gauge:
+    """ Value set directly or read from func when exported """
+
+    def __init__(self, labels, func=None) -> None:
+        self.labels = labels
+        self.value = 0
+        self._func = func
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name):
+        value = self._func() if self._func is not None else self.value
+        return [(name, self.labels, value)]
+
+
+class Histogram:
+    """
+    Fixed bucket histogram. observe() is one bisect and two additions so
+    it can sit in the per frame path.
+    """
+
+    def __init__(self, labels, buckets) -> None:
+        self.labels = labels
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self, name):
+        samples = []
+        total = 0
+        for bound, count in zip(self._buckets + ("+Inf",), self._counts):
+            total += count
+            samples.append((name + "_bucket", self.labels + (("le", str(bound)),), total))
+        samples.append((name + "_sum", self.labels, self.sum))
+        samples.append((name + "_count", self.labels, self.count))
+        return samples
+
+
+class _Timer:
+    """ Context manager observing elapsed monotonic time """
+
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram) -> None:
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.monotonic() - self._start)
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    # restart straight away after a stop without waiting for TIME_WAIT
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms by name and labels, exported in
+    Prometheus text format or as json.
+    """
+
+    def __init__(self, prefix="picamera_motion_") -> None:
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        # name: (type, help, {labels: metric})
+        self._families = {}
+
+    def _get(self, kind, name, help_text, labels, factory):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(self._prefix + name, (kind, help_text, {}))
+            metric = family[2].get(labels)
+            if metric is None:
+                metric = family[2][labels] = factory(labels)
+            return metric
+
+    def counter(self, name, help_text="", **labels):
+        return self._get("counter", name, help_text, labels, Counter)
+
+    def gauge(self, name, help_text="", func=None, **labels):
+        return self._get("gauge", name, help_text, labels,
+                         lambda labels: Gauge(labels, func))
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS, **labels):
+        return self._get("histogram", name, help_text, labels,
+                         lambda labels: Histogram(labels, buckets))
+
+    def stage(self, stage):
+        """ Latency histogram of one pipeline stage """
+        return self.histogram("stage_seconds", "Time spent per stage", stage=stage)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+        for name, (kind, help_text, metrics) in families:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for metric in list(metrics.values()):
+                for sample_name, labels, value in metric.samples(name):
+                    lines.append("{}{} {}".format(sample_name, _label_text(labels), value))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        result = {}
+        with self._lock:
+            families = sorted(self._families.items())
+        for name, (_, _, metrics) in families:
+            for metric in list(metrics.values()):
+                for sample_name, labels, value in metric.samples(name):
+                    result[sample_name + _label_text(labels)] = value
+        return result
+
+    def start_server(self, port, host="127.0.0.1"):
+        """
+        Serve /metrics (Prometheus) and /metrics.json from a thread.
+        Only this computer can connect unless host is "" (all interfaces)
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.prometheus_text().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.to_dict(), indent=1).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass   # scrapes would flood the log
+
+        server = _MetricsServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logging.info("Metrics at http://{}:{}/metrics".format(host or "<pi>", port))
+        return server
+
+    def start_json_dump(self, file_path, interval_sec):
+        """ Write all metrics to a json file every interval_sec seconds """
+        def dump():
+            while True:
+                time.sleep(interval_sec)
+                tmp_path = file_path + ".tmp"
+                try:
+                    with open(tmp_path, "w") as file:
+                        json.dump(dict(self.to_dict(), time=time.time()), file, indent=1)
+                    os.replace(tmp_path, file_path)
+                except OSError as err:
+                    logging.error("Could Not Write Metrics {} {}".format(file_path, err))
+
+        threading.Thread(target=dump, name="metrics-json", daemon=True).start()
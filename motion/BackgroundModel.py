@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class BackgroundModel:
+    """
+    Running average background with a running variance per pixel.
+    Each pixel gets its own threshold of std_factor standard deviations,
+    limited to min_threshold..max_threshold, so noisy or flickering pixels
+    need a bigger change to count as motion than steady ones.
+    All arrays are allocated once at the stream size and updated in place.
+    """
+
+    def __init__(self, alpha=0.05, std_factor=3.0, min_threshold=10,
+                 max_threshold=60) -> None:
+        self._alpha = alpha
+        self._std_factor = std_factor
+        self._min_threshold = min_threshold
+        self._max_threshold = max_threshold
+        self.mean = None
+        self._var = None
+        self._diff = None
+        self._thresholds = None
+
+    @property
+    def ready(self):
+        return self.mean is not None
+
+    def reset(self, frame):
+        """ Start a new background from frame """
+        self.mean = frame.astype(np.float32)
+        # initial thresholds equal min_threshold everywhere
+        start_std = self._min_threshold / float(self._std_factor)
+        self._var = np.full(frame.shape, start_std * start_std, dtype=np.float32)
+        self._diff = np.empty(frame.shape, dtype=np.float32)
+        self._thresholds = np.empty(frame.shape, dtype=np.float32)
+
+    def thresholds(self):
+        """ Per pixel thresholds for the current background """
+        np.sqrt(self._var, out=self._thresholds)
+        self._thresholds *= self._std_factor
+        np.clip(self._thresholds, self._min_threshold, self._max_threshold,
+                out=self._thresholds)
+        return self._thresholds
+
+    def update(self, frame):
+        """
+        Blend frame into the background. Exponentially weighted mean and
+        variance, see West 1979 incremental update.
+        """
+        if self.mean is None or self.mean.shape != frame.shape:
+            self.reset(frame)
+            return
+        diff = self._diff
+        np.subtract(frame, self.mean, out=diff)
+        # mean += alpha * diff
+        self.mean += self._alpha * diff
+        # var = (1 - alpha) * (var + alpha * diff^2)
+        np.square(diff, out=diff)
+        diff *= self._alpha
+        self._var += diff
+        self._var *= (1.0 - self._alpha)
@@ -0,0 +1,111 @@
+import numpy as np
+import motion.FrameDiffEngine as FrameDiffEngine
+
+
+class BlockDiffEngine(FrameDiffEngine.FrameDiffEngine):
+    """
+    Block grid motion detection.
+    Changed pixels are counted per block_size x block_size block with one
+    reshape-sum, a block with at least block_min_pixels changed pixels is
+    active, and 8-connected active blocks form blobs. Motion is the largest
+    blob when it has blob_min_blocks blocks and more than sensitivity
+    changed pixels, so sensor noise scattered over the frame no longer adds
+    up to an event the way it does with a whole frame pixel count.
+    With zones, pixels outside every zone are ignored and each zone's
+    threshold is used. Zone sensitivities are not used, the blob has to
+    pass sensitivity. Pixels at the right and bottom edges that do not
+    fill a whole block are ignored.
+    """
+
+    def __init__(self, threshold, sensitivity, block_size=8, block_min_pixels=8,
+                 blob_min_blocks=2, zones=None) -> None:
+        super().__init__(threshold, sensitivity, zones=zones)
+        self._block_size = max(1, block_size)
+        self._block_min_pixels = max(1, block_min_pixels)
+        self._blob_min_blocks = max(1, blob_min_blocks)
+        self._zone_thresholds = None
+
+    def _thresholds(self, shape, thresholds):
+        """ Per pixel thresholds with zones applied. 255 never changes """
+        if not self._zones:
+            return thresholds
+        if self._zone_thresholds is None or self._zone_thresholds.shape != shape:
+            zone_thresholds = np.full(shape, 255, dtype=np.uint8)
+            for zone in self._zones:
+                zone_thresholds[zone.rows, zone.cols] = np.minimum(
+                    zone_thresholds[zone.rows, zone.cols], zone.threshold)
+            self._zone_thresholds = zone_thresholds
+        if thresholds is None:
+            return self._zone_thresholds
+        return np.maximum(thresholds, self._zone_thresholds)
+
+    def block_counts(self, mask):
+        """ Changed pixel count of every block of a boolean mask """
+        size = self._block_size
+        rows = mask.shape[0] // size
+        cols = mask.shape[1] // size
+        blocks = mask[:rows * size, :cols * size].view(np.uint8)
+        return blocks.reshape(rows, size, cols, size).sum(axis=(1, 3), dtype=np.uint32)
+
+    @staticmethod
+    def largest_blob(active):
+        """
+        Row and column arrays of the biggest 8-connected group of True
+        cells in a 2-D boolean array. Only active cells are visited so
+        a quiet grid costs next to nothing.
+        """
+        rows, cols = np.nonzero(active)
+        unvisited = set(zip(rows.tolist(), cols.tolist()))
+        best = []
+        while unvisited:
+            stack = [unvisited.pop()]
+            blob = []
+            while stack:
+                row, col = stack.pop()
+                blob.append((row, col))
+                for d_row in (-1, 0, 1):
+                    for d_col in (-1, 0, 1):
+                        cell = (row + d_row, col + d_col)
+                        if cell in unvisited:
+                            unvisited.remove(cell)
+                            stack.append(cell)
+            if len(blob) > len(best):
+                best = blob
+        best_rows, best_cols = zip(*best) if best else ((), ())
+        return np.array(best_rows, dtype=int), np.array(best_cols, dtype=int)
+
+    def compare(self, data1, data2, thresholds=None):
+        """
+        Compare two 2-D single channel frames (or a background and a frame).
+        Returns a MotionResult for the largest blob when it is motion
+        otherwise None. count is the changed pixels in the blob blocks.
+        """
+        mask = self.changed_mask(data1, data2, self._thresholds(data1.shape, thresholds))
+        counts = self.block_counts(mask)
+        active = counts >= self._block_min_pixels
+        if np.count_nonzero(active) < self._blob_min_blocks:
+            return None
+        rows, cols = self.largest_blob(active)
+        if len(rows) < self._blob_min_blocks:
+            return None
+        blob_counts = counts[rows, cols]
+        blob_count = int(blob_counts.sum())
+        if blob_count <= self._sensitivity:
+            return None
+        size = self._block_size
+        # block centres weighted by their changed pixels
+        centre_x = (cols + 0.5) * size
+        centre_y = (rows + 0.5) * size
+        centroid = (float(np.average(centre_x, weights=blob_counts)),
+                    float(np.average(centre_y, weights=blob_counts)))
+        busiest = int(np.argmax(blob_counts))
+        bbox = (int(cols.min()) * size, int(rows.min()) * size,
+                (int(cols.max()) + 1) * size - 1, (int(rows.max()) + 1) * size - 1)
+        if self._zones:
+            zone_counts = dict((zone.name, int(np.count_nonzero(mask[zone.rows, zone.cols])))
+                               for zone in self._zones)
+        else:
+            zone_counts = {"frame": int(np.count_nonzero(mask))}
+        zone_counts["blob_blocks"] = len(rows)
+        return FrameDiffEngine.MotionResult(int(centre_x[busiest]), int(centre_y[busiest]),
+                                            blob_count, bbox, centroid, zone_counts)
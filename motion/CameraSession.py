@@ -0,0 +1,216 @@
+import time
+import logging
+import numpy as np
+import picamera
+import picamera.array
+from motion.FrameSource import FrameSource
+
+
+class LumaOutput:
+    """
+    picamera output object that keeps only the Y plane of yuv420 frames.
+    Frames are written into a few preallocated buffers and returned as
+    2-D numpy views of those buffers so no per frame array is allocated
+    and the U and V planes are never copied.
+    A returned frame stays valid until buffers-1 more frames are taken.
+    """
+
+    def __init__(self, stream_size, buffers=3) -> None:
+        width, height = stream_size
+        # yuv frames are padded to multiples of 32 columns and 16 rows
+        full_width = (width + 31) // 32 * 32
+        full_height = (height + 15) // 16 * 16
+        self._y_size = full_width * full_height
+        self._buffers = [bytearray(self._y_size) for _ in range(buffers)]
+        self._views = [np.frombuffer(buf, dtype=np.uint8)
+                       .reshape(full_height, full_width)[:height, :width]
+                       for buf in self._buffers]
+        self._index = 0
+        self._pos = 0
+
+    def write(self, data):
+        size = len(data)
+        if self._pos < self._y_size:
+            count = min(size, self._y_size - self._pos)
+            buf = self._buffers[self._index]
+            buf[self._pos:self._pos + count] = memoryview(data)[:count]
+        self._pos += size
+        return size
+
+    def flush(self):
+        pass
+
+    def next_frame(self):
+        """ Return the Y plane just captured and switch to the next buffer """
+        frame = self._views[self._index]
+        self._index = (self._index + 1) % len(self._buffers)
+        self._pos = 0
+        return frame
+
+
+class CameraSession(FrameSource):
+    """
+    Long lived picamera session for motion stream frames and stills.
+    With lock_exposure the shutter, gains and white balance are fixed after
+    warmup so auto exposure steps do not change every stream pixel at once.
+    Every relock_sec seconds (0 = never) they are metered again for
+    warmup_sec seconds and locked at the new values to follow daylight.
+    """
+
+    def __init__(self, image_size, stream_size, vflip=False, hflip=False,
+                 preview=False, warmup_sec=2.0, stream_format='yuv',
+                 still_video_port=False, clip_sec=0, clip_bitrate=4000000,
+                 lock_exposure=False, relock_sec=0) -> None:
+        self._image_size = image_size
+        self._stream_size = stream_size
+        self._stream_format = stream_format
+        self._still_video_port = still_video_port
+        self._clip_sec = clip_sec
+        self._clip_bitrate = clip_bitrate
+        self._clip_stream = None
+        self._vflip = vflip
+        self._hflip = hflip
+        self._preview = preview
+        self._warmup_sec = warmup_sec
+        self._lock_exposure = lock_exposure
+        self._relock_sec = relock_sec
+        self._locked_at = None
+        self._metering_until = None
+        self._camera = None
+
+    def open(self):
+        """ Open the camera once. Stream frames are resized on the gpu """
+        camera = picamera.PiCamera()
+        # sensor runs at full image size so stills need no mode change
+        camera.resolution = self._image_size
+        camera.vflip = self._vflip
+        camera.hflip = self._hflip
+        camera.exposure_mode = 'auto'
+        camera.awb_mode = 'auto'
+        if self._preview:
+            camera.start_preview()
+        # let gain and white balance settle one time only
+        time.sleep(self._warmup_sec)
+        self._camera = camera
+        if self._lock_exposure:
+            self.lock_exposure()
+        if self._clip_sec:
+            self._start_clip_buffer()
+        logging.info("Camera Session Open image={} stream={}".format(
+            self._image_size, self._stream_size))
+
+    def lock_exposure(self):
+        """ Fix shutter speed, gains and white balance at their current values """
+        camera = self._camera
+        camera.shutter_speed = camera.exposure_speed
+        camera.exposure_mode = 'off'
+        gains = camera.awb_gains
+        camera.awb_mode = 'off'
+        camera.awb_gains = gains
+        self._locked_at = time.monotonic()
+        logging.info("Camera Exposure Locked shutter={}us awb_gains=({:.2f}, {:.2f})".format(
+            camera.exposure_speed, float(gains[0]), float(gains[1])))
+
+    def _check_exposure(self):
+        """ Called for every stream frame. Meter again every relock_sec """
+        if self._locked_at is None or not self._relock_sec:
+            return
+        now = time.monotonic()
+        if self._metering_until is not None:
+            if now >= self._metering_until:
+                self._metering_until = None
+                self.lock_exposure()
+        elif now - self._locked_at >= self._relock_sec:
+            self._camera.shutter_speed = 0
+            self._camera.exposure_mode = 'auto'
+            self._camera.awb_mode = 'auto'
+            self._metering_until = now + self._warmup_sec
+
+    def _start_clip_buffer(self):
+        """
+        Record h264 on splitter port 1 into a circular buffer holding about
+        clip_sec seconds so the moments before a trigger can be saved.
+        """
+        self._clip_stream = picamera.PiCameraCircularIO(self._camera,
+                                                        seconds=self._clip_sec,
+                                                        bitrate=self._clip_bitrate,
+                                                        splitter_port=1)
+        self._camera.start_recording(self._clip_stream, format='h264',
+                                     splitter_port=1, bitrate=self._clip_bitrate)
+
+    def close(self):
+        if self._camera is not None:
+            if self._clip_stream is not None:
+                self._camera.stop_recording(splitter_port=1)
+                self._clip_stream = None
+            self._camera.close()
+            self._camera = None
+
+    def frames(self):
+        if self._stream_format == 'rgb':
+            return self._rgb_frames()
+        return self._luma_frames()
+
+    def _scaled_size(self):
+        width, height = self._stream_size
+        return (width // self.scale, height // self.scale)
+
+    def _luma_frames(self):
+        """
+        Generator yielding the Y (luma) plane of video port yuv frames.
+        A yielded frame can be kept as the previous frame while the
+        next one is captured.
+        After set_scale() the stream is restarted with the gpu resizing
+        to the new size.
+        """
+        while True:
+            scale = self.scale
+            size = self._scaled_size()
+            output = LumaOutput(size)
+            for _ in self._camera.capture_continuous(output, format='yuv',
+                                                     use_video_port=True,
+                                                     resize=size):
+                yield output.next_frame()
+                self._check_exposure()
+                if self.scale != scale:
+                    break
+
+    def _rgb_frames(self):
+        """
+        Generator yielding the green channel of video port rgb frames.
+        Each yielded array is a separate buffer so it can be kept
+        as the previous frame while the next one is captured.
+        """
+        while True:
+            scale = self.scale
+            size = self._scaled_size()
+            with picamera.array.PiRGBArray(self._camera, size=size) as stream:
+                for _ in self._camera.capture_continuous(stream, format='rgb',
+                                                         use_video_port=True,
+                                                         resize=size):
+                    yield stream.array[:, :, 1]
+                    stream.seek(0)
+                    stream.truncate()
+                    self._check_exposure()
+                    if self.scale != scale:
+                        break
+
+    def capture_still(self, image_path):
+        """
+        Take a full resolution still without re-opening the camera.
+        The video port (splitter port 2) takes it at once without a sensor
+        mode switch, which also keeps the clip recording running.
+        """
+        self.write_still(image_path)
+
+    def write_still(self, stream):
+        """ capture_still() into a file object, or a path, as jpeg """
+        if self._still_video_port or self._clip_stream is not None:
+            self._camera.capture(stream, format='jpeg', use_video_port=True,
+                                 splitter_port=2)
+        else:
+            self._camera.capture(stream, format='jpeg', use_video_port=False)
+
+    def save_clip(self, clip_path, seconds):
+        """ Write the last seconds of the h264 circular buffer to clip_path """
+        self._clip_stream.copy_to(clip_path, seconds=seconds)
@@ -0,0 +1,303 @@
+import io
+import time
+import queue
+import signal
+import logging
+import multiprocessing
+import motion.FrameSource as FrameSource
+import motion.ClipRecorder as ClipRecorder
+import motion.SharedFrameRing as SharedFrameRing
+
+# set by a SIGTERM sent to a child process, see _child_signals()
+TERMINATED = []
+
+
+def _child_term(signum, frame):
+    """
+    Only records the signal. stop.set() would take the Event lock that the
+    interrupted stop.is_set() may hold. A second SIGTERM (terminate() from
+    CapturePipeline.close) kills the process.
+    """
+    TERMINATED.append(signum)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _child_signals():
+    # ctrl-c reaches the whole process group. Only the coordinator acts on
+    # it and tells the children through stop. A SIGTERM sent to a child
+    # (systemd stops every process of the service) ends its loop as well.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _child_term)
+
+
+def _stopping(stop):
+    return bool(TERMINATED) or stop.is_set()
+
+
+def _capture_main(ring, source_args, clip_args, stop, done, commands, replies,
+                  clips_saved):
+    """
+    Capture process. Owns the camera, pushes every stream frame into the
+    shared ring and takes stills and clips when the coordinator asks.
+    Commands are (kind, request_id, image_path). "still" saves to
+    image_path, "jpeg" replies with the image bytes and "clip" starts a
+    clip. Replies are (request_id, error, data). The path of every clip
+    written is put on clips_saved.
+    """
+    _child_signals()
+    source = FrameSource.open_frame_source(**source_args)
+    try:
+        with source:
+            clips = None
+            if clip_args:
+                clips = ClipRecorder.ClipRecorder(source, source_args["stream_size"],
+                                                  **clip_args)
+            for frame in source.frames():
+                ring.push(frame)
+                if clips is not None:
+                    clips.push(frame)
+                    for clip_path in clips.saved():
+                        clips_saved.put(clip_path)
+                while True:
+                    try:
+                        kind, request_id, image_path = commands.get_nowait()
+                    except queue.Empty:
+                        break
+                    if kind == "clip":
+                        if clips is not None:
+                            clips.trigger(image_path)
+                        continue
+                    try:
+                        if kind == "jpeg":
+                            stream = io.BytesIO()
+                            source.write_still(stream)
+                            replies.put((request_id, None, stream.getvalue()))
+                        else:
+                            source.capture_still(image_path)
+                            replies.put((request_id, None, None))
+                    except Exception as err:
+                        replies.put((request_id, str(err), None))
+                if _stopping(stop):
+                    break
+            if clips is not None:
+                clips.close()
+                for clip_path in clips.saved():
+                    clips_saved.put(clip_path)
+    finally:
+        done.set()
+
+
+def _detect_main(ring, engine, background, lighting, worker, workers, stop, done,
+                 results):
+    """
+    Detector process. Compares frames straight out of the shared ring.
+    With several workers each takes every workers-th frame and compares
+    it with the frame before it. A background model is sequential so it
+    needs a single worker. A global lighting change (see LightingFilter)
+    is no motion and restarts the background.
+    Sends (seq, timestamp, MotionResult or None, diff seconds) per frame.
+    """
+    _child_signals()
+    seq = worker + 1
+    if background is None:
+        seq += 1   # the first frame has nothing to compare with
+    try:
+        while not _stopping(stop):
+            head = ring.wait(seq, timeout=0.5)
+            if head < seq:
+                if done.is_set() and ring.head < seq:
+                    break
+                continue
+            if head - seq >= ring.slots - 1:
+                # fell behind and the frames were overwritten, skip ahead
+                seq += (head - seq) // workers * workers
+            current = ring.get(seq)
+            previous = ring.get(seq - 1) if background is None else None
+            if current is None or (background is None and previous is None):
+                seq += workers
+                continue
+            frame, timestamp = current
+            start = time.monotonic()
+            result = None
+            if background is None:
+                if lighting is None or not lighting.is_global(previous[0], frame):
+                    result = engine.compare(previous[0], frame)
+            elif not background.ready:
+                background.reset(frame)
+            elif lighting is not None and lighting.is_global(background.mean, frame):
+                background.reset(frame)
+            else:
+                result = engine.compare(background.mean, frame, background.thresholds())
+                background.update(frame)
+            elapsed = time.monotonic() - start
+            # discard frames overwritten while being compared
+            if ring.valid(seq) and (background is not None or ring.valid(seq - 1)):
+                results.put((seq, timestamp, result, elapsed))
+            seq += workers
+    finally:
+        results.put(None)
+
+
+class _ClipTrigger:
+    """ Starts clips in the ClipRecorder of the capture process """
+
+    def __init__(self, commands, clips_saved) -> None:
+        self._commands = commands
+        self._clips_saved = clips_saved
+
+    def trigger(self, image_path):
+        self._commands.put(("clip", None, image_path))
+
+    def saved(self):
+        """ Paths of the clips the capture process wrote since the last call """
+        saved = []
+        while True:
+            try:
+                saved.append(self._clips_saved.get_nowait())
+            except queue.Empty:
+                return saved
+
+    def close(self):
+        pass   # the capture process closes its recorder
+
+
+class CapturePipeline:
+    """
+    Multi process motion pipeline for a multi core Pi.
+    One capture process writes stream frames into a SharedFrameRing and
+    detector processes read them without copying. The coordinator (the
+    process creating this object) gets the results, decides what to save
+    and does the saving and notification work so a slow save or upload
+    never stalls capture or detection.
+    Stills are taken by the capture process, which owns the camera, so
+    capture_still() and write_still() work like the FrameSource ones.
+    """
+
+    def __init__(self, source_args, engine, background=None, slots=8,
+                 detectors=1, clip_args=None, lighting=None) -> None:
+        if background is not None and detectors != 1:
+            logging.warning("Background Model Needs One Detector. Using 1 not {}".format(
+                detectors))
+            detectors = 1
+        self._source_args = source_args
+        self._engine = engine
+        self._background = background
+        self._lighting = lighting
+        self._detectors = detectors
+        self._clip_args = clip_args
+        self._ring = SharedFrameRing.SharedFrameRing(slots, source_args["stream_size"])
+        self._stop = multiprocessing.Event()
+        self._done = multiprocessing.Event()
+        self._commands = multiprocessing.Queue()
+        self._replies = multiprocessing.Queue()
+        self._clips_saved = multiprocessing.Queue()
+        self._results = multiprocessing.Queue(maxsize=slots * 4)
+        self._processes = []
+        self._request_id = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        capture = multiprocessing.Process(
+            target=_capture_main, name="capture",
+            args=(self._ring, self._source_args, self._clip_args, self._stop,
+                  self._done, self._commands, self._replies, self._clips_saved))
+        self._processes.append(capture)
+        for worker in range(self._detectors):
+            self._processes.append(multiprocessing.Process(
+                target=_detect_main, name="detect-{}".format(worker),
+                args=(self._ring, self._engine, self._background, self._lighting,
+                      worker, self._detectors, self._stop, self._done,
+                      self._results)))
+        for process in self._processes:
+            process.daemon = True
+            process.start()
+        logging.info("Pipeline Started 1 Capture and {} Detector Processes".format(
+            self._detectors))
+
+    def results(self, should_stop=None):
+        """
+        Yield (timestamp, MotionResult or None, diff seconds) in frame
+        order until the source runs out or should_stop() returns True.
+        Results from several detectors are put back in sequence order.
+        """
+        finished = 0
+        waiting = {}
+        next_seq = None
+        while finished < self._detectors:
+            if should_stop is not None and should_stop():
+                break
+            try:
+                item = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is None:
+                finished += 1
+                continue
+            seq = item[0]
+            if next_seq is not None and seq < next_seq:
+                continue   # too late, later frames were already used
+            waiting[seq] = item[1:]
+            while waiting:
+                if next_seq not in waiting:
+                    # every detector is past next_seq so it was dropped
+                    if len(waiting) < self._detectors:
+                        break
+                    next_seq = min(waiting)
+                yield waiting.pop(next_seq)
+                next_seq += 1
+        for seq in sorted(waiting):
+            yield waiting[seq]
+
+    def _request(self, kind, image_path, timeout):
+        self._request_id += 1
+        request_id = self._request_id
+        self._commands.put((kind, request_id, image_path))
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                reply_id, error, data = self._replies.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise RuntimeError("Capture Process Did Not Take Still {}".format(image_path))
+            # a late reply to a request that already timed out
+            if reply_id == request_id:
+                break
+        if error is not None:
+            raise RuntimeError("Capture Process Could Not Take Still {} {}".format(
+                image_path, error))
+        return data
+
+    def capture_still(self, image_path, timeout=10.0):
+        """ Ask the capture process for a full size still and wait for it """
+        self._request("still", image_path, timeout)
+
+    def write_still(self, stream, timeout=10.0):
+        """ capture_still() into a file object. The jpeg comes back by pipe """
+        stream.write(self._request("jpeg", None, timeout))
+
+    def clip_trigger(self):
+        """ Stand in for ClipRecorder.trigger() in this process """
+        return _ClipTrigger(self._commands, self._clips_saved)
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            # keep emptying the results so no detector blocks on a full queue
+            while process.is_alive() and time.monotonic() < deadline:
+                try:
+                    self._results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if process.is_alive():
+                logging.warning("Terminating {} Process".format(process.name))
+                process.terminate()
+            process.join(1.0)
+        self._processes = []
+        self._ring.close()
@@ -0,0 +1,68 @@
+import os
+import time
+import logging
+import motion.FrameRingBuffer as FrameRingBuffer
+
+
+class ClipRecorder:
+    """
+    Save a clip from pre_sec before a motion trigger to post_sec after it.
+    A source with its own clip buffer (CameraSession h264 circular buffer)
+    writes an .h264 clip. Other sources keep stream frames in a
+    FrameRingBuffer and write an .npz clip that the replay source can read.
+    Nothing here starts a camera so the clip is ready when motion fires.
+    saved() hands back the clips written so the caller can account for them.
+    """
+
+    def __init__(self, source, stream_size, pre_sec=3.0, post_sec=2.0,
+                 ring_frames=150) -> None:
+        self._source = source
+        self._pre_sec = pre_sec
+        self._post_sec = post_sec
+        self._ring = None
+        if not hasattr(source, "save_clip"):
+            self._ring = FrameRingBuffer.FrameRingBuffer(ring_frames, stream_size)
+        self._pending = None
+        self._saved = []
+
+    def push(self, frame):
+        """ Keep a stream frame. Called for every frame scanned """
+        if self._ring is not None:
+            self._ring.push(frame, time.monotonic())
+        self.poll()
+
+    def trigger(self, image_path):
+        """ Start a clip named after image_path unless one is in progress """
+        if self._pending is None:
+            now = time.monotonic()
+            self._pending = (os.path.splitext(image_path)[0], now, now + self._post_sec)
+
+    def poll(self):
+        """ Write the pending clip once the post trigger time has passed """
+        if self._pending is None or time.monotonic() < self._pending[2]:
+            return
+        clip_base, trigger_time, _ = self._pending
+        self._pending = None
+        seconds = self._pre_sec + self._post_sec
+        try:
+            if self._ring is None:
+                clip_path = clip_base + ".h264"
+                self._source.save_clip(clip_path, seconds)
+            else:
+                clip_path = clip_base + ".npz"
+                self._ring.save(clip_path, trigger_time - self._pre_sec)
+            self._saved.append(clip_path)
+            logging.info("Saved {} sec Clip {}".format(seconds, clip_path))
+        except (OSError, IOError) as err:
+            logging.error("Could Not Save Clip {} {}".format(clip_base, err))
+
+    def saved(self):
+        """ Paths of the clips written since the last call """
+        saved, self._saved = self._saved, []
+        return saved
+
+    def close(self):
+        """ Write a clip still waiting for its post trigger time """
+        if self._pending is not None:
+            self._pending = (self._pending[0], self._pending[1], 0)
+            self.poll()
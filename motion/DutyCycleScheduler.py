@@ -0,0 +1,102 @@
+import time
+import logging
+
+
+class DutyCycleScheduler:
+    """
+    Scan a quiet scene slower and at a lower stream resolution, and go
+    straight back to full rate and size when motion or a coarse brightness
+    change is seen.
+    levels is a list of dicts, fastest first, eg
+        {"idle_sec": 0, "fps": 0, "scale": 1}
+    A level is stepped down to once the scene has been quiet for its
+    idle_sec. fps 0 takes frames as fast as the source delivers them and
+    scale divides the stream width and height (see FrameSource.set_scale).
+    make_engine(scale) returns the FrameDiffEngine for a scale. Engines
+    (and their rasterised zones) are built once per scale.
+    """
+
+    def __init__(self, levels, source, make_engine, coarse_delta=8.0,
+                 report_sec=60) -> None:
+        self._levels = levels
+        self._source = source
+        self._make_engine = make_engine
+        self._engines = {}
+        self._coarse_delta = coarse_delta
+        self._report_sec = report_sec
+        self._level = 0
+        self._brightness = None
+        self._next_time = 0
+        now = time.monotonic()
+        self._last_activity = now
+        self._report_start = now
+        self._report_frames = 0
+        self.effective_fps = 0.0
+        self._apply()
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def scale(self):
+        return self._levels[self._level].get("scale", 1)
+
+    def engine(self, scale):
+        """ FrameDiffEngine for frames of the stream size divided by scale """
+        engine = self._engines.get(scale)
+        if engine is None:
+            engine = self._engines[scale] = self._make_engine(scale)
+        return engine
+
+    def _apply(self):
+        level = self._levels[self._level]
+        self._source.set_scale(level.get("scale", 1))
+        logging.info("Duty Level {} fps {} scale {}".format(
+            self._level, level.get("fps", 0) or "max", level.get("scale", 1)))
+
+    def _set_level(self, level):
+        self._level = level
+        self._apply()
+
+    def wait(self):
+        """ Sleep until the next frame is due at the current level """
+        fps = self._levels[self._level].get("fps", 0)
+        now = time.monotonic()
+        if fps and self._next_time > now:
+            time.sleep(self._next_time - now)
+            now = self._next_time
+        self._next_time = now + (1.0 / fps if fps else 0)
+
+    def update(self, result, frame, now=None):
+        """
+        Account for one scanned frame. result is its MotionResult or None.
+        Returns True when the level, and maybe the stream scale, changed.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._report_frames += 1
+        if now - self._report_start >= self._report_sec:
+            self.effective_fps = self._report_frames / (now - self._report_start)
+            logging.info("Duty Level {} Effective {:.1f} fps".format(
+                self._level, self.effective_fps))
+            self._report_start = now
+            self._report_frames = 0
+        # sparse sample of mean brightness, a few hundred pixels
+        brightness = float(frame[::16, ::16].mean())
+        coarse = (self._brightness is not None
+                  and abs(brightness - self._brightness) > self._coarse_delta)
+        self._brightness = brightness
+        if result is not None or coarse:
+            self._last_activity = now
+            if self._level:
+                self._next_time = 0
+                self._set_level(0)
+                return True
+            return False
+        next_level = self._level + 1
+        if (next_level < len(self._levels)
+                and now - self._last_activity >= self._levels[next_level]["idle_sec"]):
+            self._set_level(next_level)
+            return True
+        return False
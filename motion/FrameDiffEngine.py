@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class MotionResult:
+    """
+    Motion found in one stream frame. Coordinates are stream pixels.
+    x,y is the rough trigger position, bbox is (x0, y0, x1, y1) of the
+    changed pixels, centroid is their mean position and zone_counts
+    has the changed pixel count of every zone.
+    stream_scale is set when the frame was the stream size divided by it
+    (see DutyCycleScheduler).
+    """
+
+    def __init__(self, x, y, count, bbox, centroid, zone_counts) -> None:
+        self.x = x
+        self.y = y
+        self.count = count
+        self.bbox = bbox
+        self.centroid = centroid
+        self.zone_counts = zone_counts
+        self.stream_scale = 1
+
+    def scaled(self, x_conv, y_conv):
+        """ Return (x, y), bbox and centroid converted to full image pixels """
+        x_conv *= self.stream_scale
+        y_conv *= self.stream_scale
+        x0, y0, x1, y1 = self.bbox
+        return ((int(self.x * x_conv), int(self.y * y_conv)),
+                (int(x0 * x_conv), int(y0 * y_conv), int(x1 * x_conv), int(y1 * y_conv)),
+                (int(self.centroid[0] * x_conv), int(self.centroid[1] * y_conv)))
+
+
+class FrameDiffEngine:
+    """
+    Vectorized frame difference motion detection.
+    Without zones the whole frame is compared against threshold and
+    sensitivity. With zones (see RegionMask.build_zones) only pixels inside
+    a zone are compared, each zone with its own threshold and sensitivity.
+    """
+
+    def __init__(self, threshold, sensitivity, band_rows=16, zones=None) -> None:
+        self._threshold = threshold
+        self._sensitivity = sensitivity
+        # rows compared per step. Smaller bands exit sooner on motion,
+        # larger bands have less per call numpy overhead
+        self._band_rows = max(1, band_rows)
+        self._zones = zones or []
+
+    @staticmethod
+    def absdiff(data1, data2):
+        """
+        Absolute difference of two arrays without overflow.
+        max - min never wraps so uint8 frames need no int conversion.
+        A float background is compared the same way.
+        """
+        return np.maximum(data1, data2) - np.minimum(data1, data2)
+
+    def changed_mask(self, data1, data2, thresholds=None):
+        """
+        Return boolean array of pixels that changed more than threshold.
+        thresholds may be a per pixel array the same shape as the frames.
+        """
+        if thresholds is None:
+            thresholds = self._threshold
+        return self.absdiff(data1, data2) > thresholds
+
+    def compare(self, data1, data2, thresholds=None):
+        """
+        Compare two 2-D single channel frames (or a background and a frame).
+        Returns a MotionResult when motion is found otherwise None.
+        """
+        if self._zones:
+            return self._compare_zones(data1, data2, thresholds)
+        return self._compare_frame(data1, data2, thresholds)
+
+    def _compare_frame(self, data1, data2, thresholds):
+        """
+        Rows are scanned in bands so a quiet frame costs one pass and a
+        busy frame stops counting early. x,y is the pixel that pushed the
+        changed pixel count over sensitivity, same as the per pixel scan.
+        """
+        height = data1.shape[0]
+        diff_count = 0
+        for top in range(0, height, self._band_rows):
+            bottom = min(top + self._band_rows, height)
+            band_thresholds = None
+            if thresholds is not None:
+                band_thresholds = thresholds[top:bottom]
+            band = self.changed_mask(data1[top:bottom], data2[top:bottom],
+                                     band_thresholds)
+            band_count = int(np.count_nonzero(band))
+            if diff_count + band_count > self._sensitivity:
+                # index of the changed pixel that crossed sensitivity
+                hit = np.flatnonzero(band)[self._sensitivity - diff_count]
+                y, x = np.unravel_index(hit, band.shape)
+                # motion found so the whole frame is worth the extra pass
+                rows, cols = np.nonzero(self.changed_mask(data1, data2, thresholds))
+                return self._result(int(x), int(top + y), rows, cols,
+                                    {"frame": len(rows)})
+            diff_count += band_count
+        return None
+
+    def _compare_zones(self, data1, data2, thresholds):
+        zone_counts = {}
+        hit_rows = []
+        hit_cols = []
+        trigger = None
+        for zone in self._zones:
+            zone_thresholds = zone.threshold
+            if thresholds is not None:
+                zone_thresholds = np.maximum(thresholds[zone.rows, zone.cols],
+                                             zone.threshold)
+            changed = self.absdiff(data1[zone.rows, zone.cols],
+                                   data2[zone.rows, zone.cols]) > zone_thresholds
+            changed_idx = np.flatnonzero(changed)
+            zone_counts[zone.name] = len(changed_idx)
+            if len(changed_idx) > zone.sensitivity:
+                hit_rows.append(zone.rows[changed_idx])
+                hit_cols.append(zone.cols[changed_idx])
+                if trigger is None:
+                    hit = changed_idx[zone.sensitivity]
+                    trigger = (int(zone.cols[hit]), int(zone.rows[hit]))
+        if trigger is None:
+            return None
+        return self._result(trigger[0], trigger[1], np.concatenate(hit_rows),
+                            np.concatenate(hit_cols), zone_counts)
+
+    @staticmethod
+    def _result(x, y, rows, cols, zone_counts):
+        bbox = (int(cols.min()), int(rows.min()), int(cols.max()), int(rows.max()))
+        centroid = (float(cols.mean()), float(rows.mean()))
+        return MotionResult(x, y, len(rows), bbox, centroid, zone_counts)
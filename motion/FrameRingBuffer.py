@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Fixed size in memory ring of recent stream frames.
+    All slots are allocated up front so memory use is bounded by
+    slots * width * height bytes and the oldest frame is overwritten first.
+    """
+
+    def __init__(self, slots, stream_size) -> None:
+        width, height = stream_size
+        self._frames = np.zeros((slots, height, width), dtype=np.uint8)
+        self._times = np.zeros(slots, dtype=np.float64)
+        self._count = 0
+
+    def push(self, frame, timestamp):
+        """ Copy frame into the next slot """
+        slot = self._count % len(self._frames)
+        if frame.shape != self._frames.shape[1:]:
+            # stream size changed, frames already kept no longer fit
+            self._frames = np.zeros((len(self._frames),) + frame.shape, dtype=np.uint8)
+            self._count = slot = 0
+        self._frames[slot] = frame
+        self._times[slot] = timestamp
+        self._count += 1
+
+    def snapshot(self, since):
+        """ Return (frames, timestamps) newer than since, oldest first """
+        slots = len(self._frames)
+        if self._count <= slots:
+            order = np.arange(self._count)
+        else:
+            order = (np.arange(slots) + self._count) % slots
+        order = order[self._times[order] >= since]
+        return self._frames[order], self._times[order]
+
+    def save(self, clip_path, since):
+        """ Save frames newer than since as a .npz clip (replay source format) """
+        frames, times = self.snapshot(since)
+        np.savez_compressed(clip_path, frames=frames, times=times)
+        return len(frames)
@@ -0,0 +1,224 @@
+import os
+import glob
+import time
+import logging
+import numpy as np
+
+
+class FrameSource:
+    """
+    Base class for motion stream frame sources.
+    frames() yields 2-D uint8 arrays (one channel) of the stream size and
+    capture_still() saves a full size image of the current scene.
+    write_still() writes the same image to a file object instead.
+    set_scale() makes frames() yield frames of the stream size divided
+    by scale from the next frame on.
+    """
+
+    scale = 1
+
+    def set_scale(self, scale):
+        self.scale = scale
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def frames(self):
+        raise NotImplementedError
+
+    def capture_still(self, image_path):
+        with open(image_path, 'wb') as file:
+            self.write_still(file)
+
+    def write_still(self, stream):
+        raise NotImplementedError
+
+
+def write_pgm(stream, frame):
+    """ Write a 2-D uint8 array as a binary PGM. Needs no imaging library """
+    height, width = frame.shape
+    stream.write("P5\n{} {}\n255\n".format(width, height).encode("ascii"))
+    stream.write(np.ascontiguousarray(frame).data)
+
+
+def to_single_channel(frame):
+    """ rgb frames use the green channel like the camera stream does """
+    if frame.ndim == 3:
+        return frame[:, :, 1]
+    return frame
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Replay recorded frames from a folder of .npy/.npz files, a single .npz
+    file or a raw file of back to back 8 bit frames (.yuv files are read
+    as I420 and only the Y plane is used).
+    Stills are written as PGM images of the last replayed frame.
+    fps=0 replays frames as fast as possible.
+    """
+
+    def __init__(self, path, stream_size, loop=False, fps=0) -> None:
+        self._path = path
+        self._stream_size = stream_size
+        self._loop = loop
+        self._fps = fps
+        self._last = None
+
+    def _load_npz(self, file_name):
+        with np.load(file_name) as data:
+            for key in sorted(data.files):
+                array = data[key]
+                # a single key may hold a stack of frames. Other arrays
+                # such as clip timestamps are skipped
+                if array.ndim == 3 and array.shape[2] not in (3, 4):
+                    for frame in array:
+                        yield frame
+                elif array.ndim in (2, 3):
+                    yield array
+
+    def _load_raw(self, file_name):
+        width, height = self._stream_size
+        frame_bytes = width * height
+        if file_name.endswith(".yuv"):
+            frame_bytes = frame_bytes * 3 // 2
+        with open(file_name, 'rb') as file:
+            while True:
+                buf = file.read(frame_bytes)
+                if len(buf) < frame_bytes:
+                    break
+                yield np.frombuffer(buf, dtype=np.uint8,
+                                    count=width * height).reshape(height, width)
+
+    def _load(self):
+        if os.path.isdir(self._path):
+            for file_name in sorted(glob.glob(os.path.join(self._path, "*.np[yz]"))):
+                if file_name.endswith(".npz"):
+                    for frame in self._load_npz(file_name):
+                        yield frame
+                else:
+                    yield np.load(file_name)
+        elif self._path.endswith(".npz"):
+            for frame in self._load_npz(self._path):
+                yield frame
+        elif self._path.endswith(".npy"):
+            for frame in np.load(self._path):
+                yield frame
+        else:
+            for frame in self._load_raw(self._path):
+                yield frame
+
+    def frames(self):
+        frame_sec = 1.0 / self._fps if self._fps else 0
+        next_time = time.monotonic()
+        while True:
+            count = 0
+            for frame in self._load():
+                count += 1
+                self._last = to_single_channel(frame)
+                if frame_sec:
+                    next_time += frame_sec
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if self.scale > 1:
+                    yield self._last[::self.scale, ::self.scale]
+                else:
+                    yield self._last
+            if not self._loop or count == 0:
+                logging.info("Replay of {} Finished".format(self._path))
+                return
+
+    def write_still(self, stream):
+        write_pgm(stream, self._last)
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Generate noisy frames with a bright square crossing the scene.
+    The square moves for move_frames frames then is absent for
+    idle_frames frames so detection events repeat at a known rate.
+    fps=0 generates frames as fast as possible. object_size defaults to
+    a sixth of the stream width so the default sensitivity (about 1% of
+    the frame) is passed at any stream size.
+    """
+
+    def __init__(self, stream_size, fps=0, object_size=None, noise=2,
+                 move_frames=30, idle_frames=60, seed=0) -> None:
+        self._stream_size = stream_size
+        self._fps = fps
+        self._object_size = object_size or max(16, stream_size[0] // 6)
+        self._noise = noise
+        self._move_frames = move_frames
+        self._idle_frames = idle_frames
+        self._rng = np.random.default_rng(seed)
+        self._last = None
+
+    def frames(self):
+        width, height = self._stream_size
+        background = np.full((height, width), 96, dtype=np.uint8)
+        period = self._move_frames + self._idle_frames
+        size = self._object_size
+        frame_sec = 1.0 / self._fps if self._fps else 0
+        count = 0
+        next_time = time.monotonic()
+        while True:
+            frame = background.copy()
+            if self._noise:
+                frame += self._rng.integers(0, self._noise + 1, frame.shape,
+                                            dtype=np.uint8)
+            step = count % period
+            if step < self._move_frames:
+                x = (width - size) * step // max(1, self._move_frames - 1)
+                y = (height - size) // 2
+                frame[y:y + size, x:x + size] = 230
+            self._last = frame
+            count += 1
+            if frame_sec:
+                next_time += frame_sec
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if self.scale > 1:
+                yield frame[::self.scale, ::self.scale]
+            else:
+                yield frame
+
+    def write_still(self, stream):
+        write_pgm(stream, self._last)
+
+
+def open_frame_source(name, image_size, stream_size, path="", vflip=False,
+                      hflip=False, preview=False, stream_format='yuv',
+                      still_video_port=False, clip_sec=0, clip_bitrate=4000000,
+                      lock_exposure=False, relock_sec=0, fps=0):
+    """
+    Create the frame source named in settings.py frameSource.
+    fps paces the replay and synthetic sources, 0 = as fast as possible
+    """
+    if name == "picamera":
+        # only import picamera when it is really used
+        import motion.CameraSession as CameraSession
+        return CameraSession.CameraSession(image_size, stream_size,
+                                           vflip=vflip, hflip=hflip,
+                                           preview=preview,
+                                           stream_format=stream_format,
+                                           still_video_port=still_video_port,
+                                           clip_sec=clip_sec,
+                                           clip_bitrate=clip_bitrate,
+                                           lock_exposure=lock_exposure,
+                                           relock_sec=relock_sec)
+    if name == "replay":
+        return ReplayFrameSource(path, stream_size, fps=fps)
+    if name == "synthetic":
+        return SyntheticFrameSource(stream_size, fps=fps)
+    raise ValueError("Unknown frameSource {}".format(name))
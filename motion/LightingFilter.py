@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class LightingFilter:
+    """
+    Tell a global lighting change (a cloud, an exposure step, a light
+    switched on) from motion before a frame is compared.
+    A change is global when more than max_fraction of the pixels changed
+    more than threshold, or when the mean brightness moved more than
+    max_shift and scaling the reference to the new brightness explains
+    most of the changed pixels. Lighting scales every pixel while an
+    object only changes its own, so a big dark object moving the mean is
+    still motion.
+    Only every step-th pixel of every step-th row is used so the check
+    costs a small part of a full compare. The caller then restarts its
+    reference frame or background from the new frame instead of
+    reporting motion.
+    """
+
+    def __init__(self, threshold, max_shift=4.0, max_fraction=0.5, step=4) -> None:
+        self._threshold = threshold
+        self._max_shift = max_shift
+        self._max_fraction = max_fraction
+        self._step = max(1, step)
+
+    def is_global(self, reference, frame):
+        """ True when frame differs from reference by lighting, not motion """
+        reference = reference[::self._step, ::self._step].astype(np.float32)
+        frame = frame[::self._step, ::self._step].astype(np.float32)
+        changed = np.count_nonzero(np.abs(frame - reference) > self._threshold)
+        if changed > self._max_fraction * frame.size:
+            return True
+        reference_mean = float(reference.mean())
+        frame_mean = float(frame.mean())
+        if abs(frame_mean - reference_mean) <= self._max_shift:
+            return False
+        reference *= frame_mean / max(reference_mean, 1.0)
+        normalised = np.count_nonzero(np.abs(frame - reference) > self._threshold)
+        return normalised < changed / 2
@@ -0,0 +1,151 @@
+import time
+import logging
+
+
+class MotionEvent:
+    """
+    One motion incident from first trigger to the end of its cooldown.
+    started and ended are time.monotonic() for the tracker timing,
+    start_time, end_time and peak_time are time.time() for the record.
+    """
+
+    def __init__(self, started, start_time) -> None:
+        self.started = started
+        self.ended = started
+        self.start_time = start_time
+        self.end_time = start_time
+        self.frames = 0
+        self.peak = None
+        self.peak_time = None
+        self.peak_image = None
+        self._peak_image_count = -1
+        self.images = []
+
+    def add_frame(self, result, now, wall):
+        self.frames += 1
+        self.ended = now
+        self.end_time = wall
+        if self.peak is None or result.count > self.peak.count:
+            self.peak = result
+            self.peak_time = wall
+
+    def add_image(self, image_path, result):
+        self.images.append(image_path)
+        # peak image is the saved image with the most changed pixels
+        if result.count > self._peak_image_count:
+            self._peak_image_count = result.count
+            self.peak_image = image_path
+
+    def to_dict(self, x_conv=1.0, y_conv=1.0):
+        """ Event record with motion positions in full image pixels """
+        record = {"start": self.start_time,
+                  "end": self.end_time,
+                  "duration": round(self.ended - self.started, 3),
+                  "frames": self.frames,
+                  "images": self.images,
+                  "peak_image": self.peak_image}
+        if self.peak is not None:
+            position, bbox, centroid = self.peak.scaled(x_conv, y_conv)
+            record.update({"peak_time": self.peak_time,
+                           "peak_count": self.peak.count,
+                           "peak_xy": position,
+                           "peak_bbox": bbox,
+                           "peak_centroid": centroid})
+        return record
+
+
+class MotionEventTracker:
+    """
+    Debounce per frame motion results into motion events.
+
+    idle      -> triggered  first frame with motion
+    triggered -> active     motion for min_sec, gaps under dropout_sec allowed
+    triggered -> idle       no motion for dropout_sec before that (a blip)
+    active    -> cooldown   a frame without motion
+    cooldown  -> active     motion again within gap_sec
+    cooldown  -> idle       no motion for gap_sec, the event is closed
+
+    While active at most max_images images are saved per event, no closer
+    together than keyframe_sec.
+    Timing uses time.monotonic() so a clock step (a Pi has no RTC and
+    sets the time over the network) does not stall or stretch an event.
+    """
+
+    IDLE = "idle"
+    TRIGGERED = "triggered"
+    ACTIVE = "active"
+    COOLDOWN = "cooldown"
+
+    def __init__(self, min_sec=0.3, gap_sec=5.0, max_images=5, keyframe_sec=2.0,
+                 dropout_sec=0.1) -> None:
+        self._min_sec = min_sec
+        self._dropout_sec = dropout_sec
+        self._gap_sec = gap_sec
+        self._max_images = max_images
+        self._keyframe_sec = keyframe_sec
+        self.state = self.IDLE
+        self.event = None
+        self._last_motion = 0.0
+        self._last_save = None
+
+    def _set_state(self, state):
+        logging.debug("Motion Event {} -> {}".format(self.state, state))
+        self.state = state
+
+    def update(self, result, now=None, wall=None):
+        """
+        Feed the MotionResult (or None) of one frame. now is
+        time.monotonic() and wall time.time() for the event record.
+        Returns (save, closed_event). save is True when this frame should
+        be saved as an event image and closed_event is the MotionEvent
+        that just ended, if any.
+        """
+        if now is None:
+            now = time.monotonic()
+        if wall is None:
+            wall = time.time()
+        closed = None
+        if result is not None:
+            self._last_motion = now
+            if self.state == self.IDLE:
+                self.event = MotionEvent(now, wall)
+                self._last_save = None
+                self._set_state(self.TRIGGERED)
+            elif self.state == self.COOLDOWN:
+                self._set_state(self.ACTIVE)
+            self.event.add_frame(result, now, wall)
+            if self.state == self.TRIGGERED and now - self.event.started >= self._min_sec:
+                self._set_state(self.ACTIVE)
+        elif self.state == self.TRIGGERED:
+            if now - self._last_motion < self._dropout_sec:
+                # slow or pausing motion often misses a frame or two
+                return False, None
+            # motion too short to be an event
+            self.event = None
+            self._set_state(self.IDLE)
+        elif self.state == self.ACTIVE:
+            self._set_state(self.COOLDOWN)
+        elif self.state == self.COOLDOWN and now - self._last_motion >= self._gap_sec:
+            closed = self.event
+            self.event = None
+            self._set_state(self.IDLE)
+        return self._should_save(result, now), closed
+
+    def _should_save(self, result, now):
+        if result is None or self.state != self.ACTIVE:
+            return False
+        if len(self.event.images) >= self._max_images:
+            return False
+        if self._last_save is not None and now - self._last_save < self._keyframe_sec:
+            return False
+        self._last_save = now
+        return True
+
+    def close(self):
+        """ End the event in progress, if any, and return it """
+        closed = None
+        if self.event is not None and self.state in (self.ACTIVE, self.COOLDOWN):
+            closed = self.event
+        self.event = None
+        self.state = self.IDLE
+        return closed
@@ -0,0 +1,140 @@
+import time
+import logging
+import motion.FrameDiffEngine as FrameDiffEngine
+import motion.BlockDiffEngine as BlockDiffEngine
+import motion.RegionMask as RegionMask
+import motion.BackgroundModel as BackgroundModel
+import motion.LightingFilter as LightingFilter
+import monitoring.Metrics as Metrics
+
+
+def make_engine(stream_size, threshold, sensitivity, scale=1, zones=(),
+                block_size=0, block_min_pixels=8, blob_min_blocks=2):
+    """
+    FrameDiffEngine for stream_size (width, height) divided by scale.
+    Zones are rasterised once. Pixels outside all zones are never compared
+    With a block_size it is a BlockDiffEngine with blocks covering the
+    same part of the scene at every scale.
+    """
+    width, height = stream_size
+    zones = RegionMask.build_zones(zones, width // scale, height // scale,
+                                   threshold, sensitivity, scale=scale)
+    if block_size:
+        return BlockDiffEngine.BlockDiffEngine(
+            threshold, max(1, sensitivity // (scale * scale)),
+            block_size=max(1, block_size // scale),
+            block_min_pixels=max(1, block_min_pixels // (scale * scale)),
+            blob_min_blocks=blob_min_blocks, zones=zones)
+    return FrameDiffEngine.FrameDiffEngine(threshold,
+                                           max(1, sensitivity // (scale * scale)),
+                                           zones=zones)
+
+
+def make_detector(settings):
+    """
+    Engine factory, background model and lighting filter for the motion
+    settings of settings (the settings.py module). Returns
+    (make_engine(scale=1), background, lighting), background and lighting
+    are None when turned off. picamera-motion.py and benchmark.py both
+    build their detector here so the benchmark scans the same way.
+    """
+    engine_args = dict(stream_size=(settings.streamWidth, settings.streamHeight),
+                       threshold=settings.threshold, sensitivity=settings.sensitivity,
+                       zones=settings.motionZones,
+                       block_size=settings.motionBlockSize if settings.motionBlockOn else 0,
+                       block_min_pixels=settings.motionBlockMinPixels,
+                       blob_min_blocks=settings.motionBlobMinBlocks)
+
+    def engine_for(scale=1):
+        return make_engine(scale=scale, **engine_args)
+
+    background = None
+    if settings.motionBackgroundOn:
+        background = BackgroundModel.BackgroundModel(alpha=settings.backgroundAlpha,
+                                                     std_factor=settings.backgroundStdFactor,
+                                                     min_threshold=settings.threshold,
+                                                     max_threshold=settings.backgroundMaxThreshold)
+    lighting = None
+    if settings.lightingFilterOn:
+        lighting = LightingFilter.LightingFilter(settings.threshold,
+                                                 max_shift=settings.lightingMaxShift,
+                                                 max_fraction=settings.lightingMaxFraction)
+    return engine_for, background, lighting
+
+
+def scan_motion(frames, engine, stream_height, background=None, clips=None,
+                metrics=None, scheduler=None, lighting=None, diff_times=None):
+    """
+    Generator yielding a FrameDiffEngine.MotionResult, or None when no
+    motion was found, for every stream frame.
+    Without a background model each frame is compared with the previous
+    frame. With one, frames are compared with the running background
+    using its per pixel thresholds.
+    Every frame is also handed to the clip recorder when clips are on.
+    The wait for each frame is timed as stage "capture" and the compare
+    as stage "diff". Each compare time is also appended to diff_times
+    when a list is given.
+    A DutyCycleScheduler paces the frames and sets the stream scale. The
+    engine is picked for the scale of each frame (stream_height divided
+    by the frame height) and the first frame of a new size restarts the
+    reference frame or background.
+    A global lighting change found by the LightingFilter is not motion.
+    The new frame becomes the reference (or background) instead.
+    """
+    if metrics is None:
+        metrics = Metrics.MetricsRegistry()   # recorded but never exported
+    capture_time = metrics.stage("capture")
+    diff_time = metrics.stage("diff")
+    scanned = metrics.counter("frames_scanned_total", "Stream frames scanned")
+    relit = metrics.counter("lighting_changes_total",
+                            "Global lighting changes ignored as motion")
+    frames = iter(frames)
+    data1 = None
+    scale = 1
+    while True:
+        if scheduler is not None:
+            scheduler.wait()
+        start = time.monotonic()
+        frame = next(frames, None)
+        if frame is None:
+            break   # a replay source has run out of frames
+        diff_start = time.monotonic()
+        capture_time.observe(diff_start - start)
+        scanned.inc()
+        if clips is not None:
+            clips.push(frame)
+        if scheduler is not None:
+            scale = max(1, stream_height // frame.shape[0])
+            engine = scheduler.engine(scale)
+        if background is None:
+            if data1 is None or data1.shape != frame.shape:
+                data1 = frame
+                continue
+            if lighting is not None and lighting.is_global(data1, frame):
+                relit.inc()
+                logging.info("Lighting Change. Not Motion")
+                result = None
+            else:
+                result = engine.compare(data1, frame)
+            data1 = frame
+        elif not background.ready or background.mean.shape != frame.shape:
+            background.reset(frame)
+            continue
+        elif lighting is not None and lighting.is_global(background.mean, frame):
+            relit.inc()
+            logging.info("Lighting Change. Background Restarted")
+            background.reset(frame)
+            result = None
+        else:
+            result = engine.compare(background.mean, frame,
+                                    background.thresholds())
+            background.update(frame)
+        diff_sec = time.monotonic() - diff_start
+        diff_time.observe(diff_sec)
+        if diff_times is not None:
+            diff_times.append(diff_sec)
+        if scheduler is not None:
+            if result is not None:
+                result.stream_scale = scale
+            scheduler.update(result, frame)
+        yield result
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class MotionZone:
+    """
+    One detection zone rasterised to the stream size.
+    Only the pixel coordinates inside the zone are kept so pixels
+    outside every zone are never read by the detector.
+    """
+
+    def __init__(self, name, mask, threshold, sensitivity) -> None:
+        self.name = name
+        # row major order so the first changed pixels are found top down
+        self.rows, self.cols = np.nonzero(mask)
+        self.threshold = threshold
+        self.sensitivity = sensitivity
+
+    @property
+    def size(self):
+        return len(self.rows)
+
+
+def rasterize(shape, width, height):
+    """
+    Return a boolean (height, width) mask for a zone shape dict.
+    {"rect": (x0, y0, x1, y1)} or {"polygon": [(x, y), ...]}
+    Coordinates are fractions of the frame (0.0 - 1.0) so zones keep
+    their place when the stream size changes. A pixel belongs to the
+    shape when its centre is inside it.
+    """
+    xs = (np.arange(width, dtype=np.float32) + 0.5) / width
+    ys = (np.arange(height, dtype=np.float32) + 0.5) / height
+    if "rect" in shape:
+        x0, y0, x1, y1 = shape["rect"]
+        return ((ys >= y0) & (ys < y1))[:, None] & ((xs >= x0) & (xs < x1))[None, :]
+    if "polygon" in shape:
+        px = xs[None, :]
+        py = ys[:, None]
+        mask = np.zeros((height, width), dtype=bool)
+        points = list(shape["polygon"])
+        # even-odd rule, one vectorised pass per polygon edge
+        for (ax, ay), (bx, by) in zip(points, points[1:] + points[:1]):
+            if ay == by:
+                continue
+            crosses = (ay > py) != (by > py)
+            edge_x = ax + (py - ay) * (bx - ax) / (by - ay)
+            mask ^= crosses & (px < edge_x)
+        return mask
+    raise ValueError("Zone shape needs a rect or polygon {}".format(shape))
+
+
+def build_zones(zone_config, width, height, threshold, sensitivity, scale=1):
+    """
+    Rasterise the settings.py motionZones list once for a stream size.
+    Each zone dict has a rect or polygon, an optional list of "exclude"
+    shapes cut out of it and optional "threshold" and "sensitivity"
+    that default to the global settings.
+    For a stream scaled down by scale, zone sensitivities (pixel counts)
+    are divided by scale squared.
+    """
+    zones = []
+    for num, config in enumerate(zone_config):
+        mask = rasterize(config, width, height)
+        for shape in config.get("exclude", []):
+            mask &= ~rasterize(shape, width, height)
+        zones.append(MotionZone(config.get("name", "zone{}".format(num)), mask,
+                                config.get("threshold", threshold),
+                                max(1, config.get("sensitivity", sensitivity) // (scale * scale))))
+    return zones
@@ -0,0 +1,111 @@
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedFrameRing:
+    """
+    Ring of stream frames in shared memory for passing frames between
+    processes without pickling. All slots are numpy arrays over one
+    preallocated shared memory block.
+    Every pushed frame gets the next sequence number. The writer never
+    waits for readers: it overwrites the oldest slot (drop oldest) so a
+    slow detector can not stall capture. Readers get zero copy views and
+    must call valid(seq) after using a frame. If the writer has reused the
+    slot meanwhile the frame may be torn and has to be discarded.
+    Frames smaller than the ring size (a lower stream resolution) use the
+    top left corner of their slot.
+    """
+
+    # per slot header: sequence number (0 while being written), height, width
+    HEADER = 3
+
+    def __init__(self, slots, stream_size, name=None, condition=None) -> None:
+        self._slots = slots
+        self._stream_size = stream_size
+        width, height = stream_size
+        header_bytes = 8 * (1 + slots * self.HEADER)
+        times_bytes = 8 * slots
+        size = header_bytes + times_bytes + slots * width * height
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            condition = multiprocessing.Condition()
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._cond = condition
+        buf = self._shm.buf
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self._header = np.ndarray((slots, self.HEADER), dtype=np.int64,
+                                  buffer=buf, offset=8)
+        self._times = np.ndarray((slots,), dtype=np.float64, buffer=buf,
+                                 offset=header_bytes)
+        self._frames = np.ndarray((slots, height, width), dtype=np.uint8, buffer=buf,
+                                  offset=header_bytes + times_bytes)
+        if self._owner:
+            self._head[0] = 0
+            self._header[:] = 0
+
+    def __getstate__(self):
+        # child processes attach to the same block by name
+        return (self._slots, self._stream_size, self._shm.name, self._cond)
+
+    def __setstate__(self, state):
+        slots, stream_size, name, condition = state
+        self.__init__(slots, stream_size, name=name, condition=condition)
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def head(self):
+        """ Sequence number of the newest complete frame, 0 if none yet """
+        return int(self._head[0])
+
+    def push(self, frame, timestamp=None):
+        """ Copy frame into the oldest slot and wake waiting readers """
+        seq = int(self._head[0]) + 1
+        slot = seq % self._slots
+        height, width = frame.shape
+        header = self._header[slot]
+        header[0] = 0
+        self._frames[slot, :height, :width] = frame
+        self._times[slot] = time.time() if timestamp is None else timestamp
+        header[1] = height
+        header[2] = width
+        header[0] = seq
+        self._head[0] = seq
+        with self._cond:
+            self._cond.notify_all()
+        return seq
+
+    def wait(self, seq, timeout=None):
+        """ Wait until frame seq has been pushed. Returns the head sequence """
+        if self._head[0] < seq:
+            with self._cond:
+                self._cond.wait_for(lambda: self._head[0] >= seq, timeout)
+        return int(self._head[0])
+
+    def get(self, seq):
+        """
+        Return (frame view, timestamp) of frame seq or None if it has
+        already been overwritten
+        """
+        slot = seq % self._slots
+        header = self._header[slot]
+        if header[0] != seq:
+            return None
+        return self._frames[slot, :header[1], :header[2]], float(self._times[slot])
+
+    def valid(self, seq):
+        """ True while frame seq has not been overwritten """
+        return self._header[seq % self._slots, 0] == seq
+
+    def close(self):
+        # numpy views must go before the shared memory can be closed
+        self._head = self._header = self._times = self._frames = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,128 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class TokenBucket:
+    """ Token bucket rate limit. rate tokens per second, up to burst tokens """
+
+    def __init__(self, rate, burst) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait_time(self):
+        """ Seconds until a token is available """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                return 0.0
+            return (1 - self._tokens) / self._rate
+
+    def take(self):
+        """ Take a token if one is available """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class BurstAggregator:
+    """
+    Collect items added within window_sec of the first one and hand them
+    to send(items) as one batch of at most max_items. Batches are sent no
+    faster than the token bucket allows, and items keep collecting while
+    waiting for a token. add() returns a Future for the item that is done
+    once the batch holding it was sent, or fails with the send error, so
+    the caller only counts an item as delivered after the send worked.
+    At most max_pending items are held, the oldest are dropped first and
+    their futures fail.
+    """
+
+    def __init__(self, send, window_sec=5.0, max_items=10, bucket=None,
+                 max_pending=100) -> None:
+        self._send = send
+        self._window_sec = window_sec
+        self._max_items = max_items
+        self._bucket = bucket
+        self._max_pending = max_pending
+        self._pending = []
+        self._deadline = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="burst", daemon=True)
+        self._thread.start()
+
+    def add(self, item):
+        """ Queue item for the next batch. Returns a Future for its send """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                future.set_exception(RuntimeError("Burst aggregator is closed"))
+                return future
+            self._pending.append((item, future))
+            if len(self._pending) > self._max_pending:
+                dropped, dropped_future = self._pending.pop(0)
+                logging.warning("Burst Queue Full. Dropped {}".format(dropped))
+                dropped_future.set_exception(RuntimeError("Burst queue full"))
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self._window_sec
+            self._cond.notify()
+        return future
+
+    def close(self, timeout=10.0):
+        """ Send what is pending then stop """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        """ Wait for a full window and a token then take a batch """
+        with self._cond:
+            while True:
+                if self._pending:
+                    delay = self._deadline - time.monotonic()
+                    if len(self._pending) >= self._max_items or self._closed:
+                        delay = 0
+                    if delay <= 0 and self._bucket is not None and not self._closed:
+                        delay = self._bucket.wait_time()
+                    if delay <= 0:
+                        if self._bucket is not None:
+                            self._bucket.take()
+                        batch = self._pending[:self._max_items]
+                        del self._pending[:self._max_items]
+                        self._deadline = None
+                        if self._pending:
+                            self._deadline = time.monotonic() + self._window_sec
+                        return batch
+                    self._cond.wait(delay)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._send([item for item, _ in batch])
+            except Exception as err:
+                logging.error("Burst Send of {} Items Failed {}".format(len(batch), err))
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+            for _, future in batch:
+                future.set_result(None)
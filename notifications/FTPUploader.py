@@ -1,19 +1,159 @@
-from pathlib import Path
-import requests
-import os
-#import pysftp
-from ftplib import FTP
+import time
+import queue
+import logging
+import threading
+from ftplib import FTP, all_errors
+
+
+class MemoryReader:
+    """
+    Read only file object over an in memory image. read() returns
+    memoryview slices so storbinary sends the image without copying it.
+    """
+
+    def __init__(self, data) -> None:
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size < 0 else min(self._pos + size, len(self._view))
+        chunk = self._view[self._pos:end]
+        self._pos = end
+        return chunk
+
 
 class FTPUploader:
-    """ Send Teams Notification """
+    """
+    Upload images to an ftp server.
+    Up to pool_size authenticated sessions are kept open and reused.
+    Every keepalive_sec a background thread sends NOOP on sessions idle
+    that long so the server idle timeout does not close them. A session is
+    also checked with NOOP before use when it was idle for more than
+    keepalive_sec and a broken session is replaced by a new login.
+    keepalive_sec 0 turns both checks off.
+    """
 
     def __init__(self, config) -> None:
         self._config = config
+        self._pool_size = config.get("pool_size", 2)
+        self._keepalive_sec = config.get("keepalive_sec", 30)
+        self._timeout = config.get("timeout", 30)
+        # most recently used session first
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self._pool_size)
+        self._closed = threading.Event()
+        self._thread = None
+        if self._keepalive_sec > 0:
+            self._thread = threading.Thread(target=self._keepalive, name="ftp-keepalive",
+                                            daemon=True)
+            self._thread.start()
+
+    def _connect(self):
+        srv = FTP(timeout=self._timeout)
+        srv.connect(self._config["host"], self._config.get("port", 21))
+        srv.login(user=self._config["username"], passwd=self._config["password"])
+        srv.cwd(self._config["path"])  # chdir to public
+        return srv
 
-    def upload(self, image_path, image_fname):
+    @staticmethod
+    def _quit(srv):
+        try:
+            srv.quit()
+        except all_errors:
+            srv.close()
 
-        srv = FTP(host=self._config["host"], user=self._config["username"],
-        passwd=self._config["password"])
-        srv.cwd(self._config["path"]) #chdir to public
+    def _acquire(self):
+        try:
+            srv, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if self._keepalive_sec and time.monotonic() - last_used > self._keepalive_sec:
+            try:
+                srv.voidcmd("NOOP")
+            except all_errors:
+                logging.info("FTP Session Expired. Reconnecting")
+                srv.close()
+                return self._connect()
+        return srv
+
+    def _release(self, srv):
+        """ Back to the idle pool, or log out when the pool is already full """
+        if self._idle.qsize() >= self._pool_size or self._closed.is_set():
+            self._quit(srv)
+            return
+        self._idle.put((srv, time.monotonic()))
+
+    def _keepalive(self):
+        """ NOOP idle sessions so the server does not time them out """
+        while not self._closed.wait(self._keepalive_sec):
+            # one slot keeps the sweep inside pool_size, skipped while all are busy
+            if not self._slots.acquire(blocking=False):
+                continue
+            try:
+                sessions = []
+                while True:
+                    try:
+                        sessions.append(self._idle.get_nowait())
+                    except queue.Empty:
+                        break
+                # oldest first so the most recently used ends on top again
+                for srv, last_used in reversed(sessions):
+                    if time.monotonic() - last_used < self._keepalive_sec:
+                        self._idle.put((srv, last_used))
+                        continue
+                    try:
+                        srv.voidcmd("NOOP")
+                    except all_errors:
+                        logging.info("FTP Idle Session Expired")
+                        srv.close()
+                        continue
+                    self._release(srv)
+            finally:
+                self._slots.release()
+
+    def upload(self, image_path, image_fname, data=None):
+        """
+        Upload one image over a pooled session. data is the image in memory
+        (bytes, bytearray or memoryview) and is sent instead of reading
+        image_path. A failed transfer is retried once on a fresh connection.
+        """
+        with self._slots:
+            srv = self._acquire()
+            try:
+                try:
+                    self._store(srv, image_path, image_fname, data)
+                except all_errors as err:
+                    logging.warning("FTP Upload of {} Failed {}. Reconnecting".format(
+                        image_fname, err))
+                    srv.close()
+                    srv = self._connect()
+                    self._store(srv, image_path, image_fname, data)
+            except BaseException:
+                # state of a failed session is unknown so do not reuse it
+                srv.close()
+                raise
+            self._release(srv)
+
+    @staticmethod
+    def _store(srv, image_path, image_fname, data=None):
+        if data is not None:
+            srv.storbinary('STOR {}'.format(image_fname), MemoryReader(data))
+            return
         with open(image_path, 'rb') as file:
-            srv.storbinary('STOR {}'.format(image_fname), file) 
+            srv.storbinary('STOR {}'.format(image_fname), file)
+
+    def deliver(self, image_path, image_fname, data=None):
+        """ NotificationQueue entry point """
+        self.upload(image_path, image_fname, data)
+
+    def close(self):
+        """ Stop the keepalive thread and log out of all idle sessions """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(self._timeout)
+        while True:
+            try:
+                srv, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(srv)
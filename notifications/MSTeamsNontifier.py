@@ -1,11 +1,34 @@
+import os
 import requests
 import logging
 import json
+from notifications.BurstAggregator import BurstAggregator, TokenBucket
 
 class MSTeamsNontifier:
-    """ Send Teams Notification """
-    def __init__(self, config) -> None:
+    """
+    Send Teams Notification.
+    Images detected within window_sec (default 10) of the first one are
+    merged into one card of up to max_images and cards are rate limited to
+    rate_per_min (burst of rate_burst) to stay under Teams throttling.
+    window_sec 0 posts one card per image.
+    With merging deliver() returns a Future that is done once the card
+    holding the image was posted, NotificationQueue waits on it.
+    """
+    def __init__(self, config, image_root=None) -> None:
         self._config = config
+        # images are linked by their path under image_root (date folders)
+        self._image_root = image_root
+        # keep alive connection pool reused for every post
+        self._session = requests.Session()
+        self._aggregator = None
+        window_sec = config.get("window_sec", 10)
+        if window_sec > 0:
+            bucket = TokenBucket(config.get("rate_per_min", 4) / 60.0,
+                                 config.get("rate_burst", 2))
+            self._aggregator = BurstAggregator(self._notify_burst,
+                                               window_sec=window_sec,
+                                               max_items=config.get("max_images", 10),
+                                               bucket=bucket)
 
     # @staticmethod
     # def _encode64(image_path):
@@ -15,7 +38,12 @@ class MSTeamsNontifier:
     #     return encoded_string
 
     def notify(self, text, image_url):
-        """ This function will send a webhook notification to a teams channel """
+        """
+        This function will send a webhook notification to a teams channel.
+        image_url may be a single url or a list of urls shown on one card.
+        """
+        if isinstance(image_url, str):
+            image_url = [image_url]
         schema = {
             "@type": "MessageCard",
             "text": text,
@@ -24,17 +52,43 @@ class MSTeamsNontifier:
                     "images": [
                         {
                             #"image": "data:image/jpeg;base64,{}".format(MSTeamsNontifier._encode64(image_path).decode("utf-8"))"
-                            "image": image_url
-                        }
+                            "image": url
+                        } for url in image_url
                     ]
                 }
             ]
         }
-        logging.error(json.dumps(schema))
-        res = requests.post(self._config["webhook_url"], json=schema)
-        
+        logging.debug(json.dumps(schema))
+        res = self._session.post(self._config["webhook_url"], json=schema,
+                                 timeout=self._config.get("timeout", 30))
+
         if res.content != b'1':
             logging.error("Status Code: {}, Response {}".format(
                         res.status_code, res.content))
-            raise "The notification went wrong" 
+            raise RuntimeError("The notification went wrong")
+
+    def _notify_burst(self, image_urls):
+        if len(image_urls) == 1:
+            self.notify("Detected motion", image_urls[0])
+        else:
+            self.notify("Detected motion ({} images)".format(len(image_urls)), image_urls)
+
+    def deliver(self, image_path, image_fname, data=None):
+        """
+        NotificationQueue entry point. The card links the image, data is not
+        sent. With an image_root the link keeps the date folders of the
+        image so base_image can be the webserver.py url.
+        """
+        if self._image_root is not None:
+            image_fname = os.path.relpath(image_path, self._image_root).replace(os.sep, "/")
+        image_url = self._config["base_image"] + "/" + image_fname
+        if self._aggregator is not None:
+            return self._aggregator.add(image_url)
+        self.notify("Detected motion", image_url)
+        return None
 
+    def close(self):
+        """ Send any merged card still waiting then close the http session """
+        if self._aggregator is not None:
+            self._aggregator.close()
+        self._session.close()
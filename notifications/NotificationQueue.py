@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import queue
+import logging
+import threading
+import itertools
+import functools
+import collections
+from concurrent.futures import Future
+
+
+class NotificationQueue:
+    """
+    Deliver saved images to every notifier from a pool of worker threads
+    so a slow or failing ftp server or webhook never stalls motion detection.
+
+    notifiers is a dict of name: object with a
+    deliver(image_path, image_fname, data=None) method. data is the image
+    in memory when it was captured to memory, shared by every notifier.
+    deliver() may return a concurrent.futures.Future when the notifier
+    sends later (teams merging images into one card). The worker moves on
+    and the notifier only counts as delivered once the future is done.
+    Failed deliveries are retried with exponential backoff and only the
+    notifiers that failed are tried again. A failed job waits out its
+    backoff outside the queue so the workers keep delivering other jobs.
+    A job still failing after the last retry stays in the spool and is
+    tried again on the next start. When the queue is full
+    drop_policy decides what happens: "block" waits for room (backpressure),
+    "drop_newest" discards the new image and "drop_oldest" discards the
+    oldest waiting image. Pending jobs are kept as json files in spool_path
+    so they are delivered after a restart (from image_path, the in memory
+    image is not spooled). Jobs without an image file, nothing to resume
+    from, are not spooled. Spooled jobs are fed in as the queue has room
+    and the drop policy never discards them.
+    on_delivered(image_path, name) is called after each successful delivery.
+    With a metrics registry each deliver() is timed as stage name and
+    failures and drops are counted.
+    """
+
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, notifiers, max_size=50, workers=2, retries=3,
+                 retry_delay=2.0, drop_policy="drop_oldest",
+                 spool_path=None, on_delivered=None, metrics=None) -> None:
+        if drop_policy not in self.POLICIES:
+            raise ValueError("Unknown drop policy {}".format(drop_policy))
+        self._notifiers = notifiers
+        self._queue = queue.Queue(maxsize=max_size)
+        self._workers = workers
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._drop_policy = drop_policy
+        self._spool_path = spool_path
+        self._on_delivered = on_delivered
+        self._metrics = metrics
+        self._stop = threading.Event()
+        self._threads = []
+        self._resumed = collections.deque()   # spooled jobs waiting for room
+        self._retry = []   # heap of (not before time, seq, job) backing off
+        self._retry_lock = threading.Lock()
+        self._retry_seq = itertools.count()
+        self._job_lock = threading.Lock()   # job state finished by futures
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """ Start the worker threads then feed in the spooled jobs """
+        for num in range(self._workers):
+            thread = threading.Thread(target=self._run,
+                                      name="notify-{}".format(num), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self._spool_path:
+            if not os.path.isdir(self._spool_path):
+                os.makedirs(self._spool_path)
+            self._load_spool()
+            thread = threading.Thread(target=self._feed_spool,
+                                      name="notify-spool", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the workers. Jobs still waiting or backing off stay in the
+        spool and are delivered on the next start.
+        """
+        self._stop.set()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, image_path, image_fname, data=None):
+        """ Queue an image for every notifier. Returns False if dropped """
+        job = {"id": uuid.uuid4().hex,
+               "image_path": image_path,
+               "image_fname": image_fname,
+               "pending": sorted(self._notifiers),
+               "data": data}
+        self._save_job(job)
+        return self._put(job)
+
+    def _put(self, job):
+        if self._drop_policy == "block":
+            self._queue.put(job)
+            return True
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            pass
+        if self._drop_policy == "drop_oldest":
+            try:
+                oldest = self._queue.get_nowait()
+                if oldest is not None and oldest.get("resumed"):
+                    self._resumed.appendleft(oldest)   # fed in again later
+                else:
+                    self._drop(oldest)
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(job)
+                return True
+            except queue.Full:
+                pass
+        self._drop(job)
+        return False
+
+    def _drop(self, job):
+        if job is None:
+            return
+        logging.warning("Notification Queue Full. Dropped {}".format(job["image_fname"]))
+        if self._metrics is not None:
+            self._metrics.counter("notify_dropped_total", "Images dropped from a full queue").inc()
+        self._remove_job(job)
+
+    def _feed_spool(self):
+        """ Move spooled jobs into the queue as it has room """
+        while not self._stop.is_set():
+            try:
+                job = self._resumed.popleft()
+            except IndexError:
+                self._stop.wait(0.5)
+                continue
+            while True:
+                try:
+                    self._queue.put(job, timeout=0.5)
+                    break
+                except queue.Full:
+                    if self._stop.is_set():
+                        return   # still in the spool for the next start
+
+    def _due_retry(self):
+        """ The backed off job whose retry time has come, or None """
+        with self._retry_lock:
+            if self._retry and self._retry[0][0] <= time.monotonic():
+                return heapq.heappop(self._retry)[2]
+        return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self._due_retry()
+            if job is None:
+                try:
+                    # short wait so a due retry is not stuck behind an idle queue
+                    job = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if job is None:
+                    break
+            self._deliver(job)
+
+    def _deliver(self, job):
+        """ One attempt for every pending notifier. Failures are retried later """
+        attempt = job.get("attempts", 0)
+        job["attempts"] = attempt + 1
+        # held by this attempt until every notifier was started
+        job["outstanding"] = 1
+        for name in list(job["pending"]):
+            started = time.monotonic()
+            try:
+                result = self._notifiers[name].deliver(job["image_path"], job["image_fname"],
+                                                       job.get("data"))
+            except Exception as err:
+                self._failed(job, name, attempt, started, err)
+                continue
+            if isinstance(result, Future):
+                with self._job_lock:
+                    job["outstanding"] += 1
+                result.add_done_callback(functools.partial(self._done, job, name,
+                                                           attempt, started))
+            else:
+                self._delivered(job, name, started)
+        self._release(job, attempt)
+
+    def _done(self, job, name, attempt, started, future):
+        """ A notifier that returned a future finished sending """
+        err = future.exception()
+        if err is None:
+            self._delivered(job, name, started)
+        else:
+            self._failed(job, name, attempt, started, err)
+        self._release(job, attempt)
+
+    def _delivered(self, job, name, started):
+        if self._metrics is not None:
+            self._metrics.stage(name).observe(time.monotonic() - started)
+        with self._job_lock:
+            job["pending"].remove(name)
+        if self._on_delivered is not None:
+            self._on_delivered(job["image_path"], name)
+
+    def _failed(self, job, name, attempt, started, err):
+        logging.error("{} Failed for {} (attempt {}) {}".format(
+            name, job["image_fname"], attempt + 1, err))
+        if self._metrics is not None:
+            self._metrics.stage(name).observe(time.monotonic() - started)
+            self._metrics.counter("notify_failures_total", "Failed deliveries",
+                                  notifier=name).inc()
+
+    def _release(self, job, attempt):
+        """ Finish the attempt once no notifier is still sending """
+        with self._job_lock:
+            job["outstanding"] -= 1
+            if job["outstanding"] > 0:
+                return
+        if not job["pending"]:
+            self._remove_job(job)
+            return
+        self._save_job(job)
+        if attempt < self._retries:
+            # exponential backoff without holding this worker
+            not_before = time.monotonic() + self._retry_delay * (2 ** attempt)
+            with self._retry_lock:
+                heapq.heappush(self._retry, (not_before, next(self._retry_seq), job))
+            return
+        # left in the spool, if it has a file, for the next start
+        logging.error("Giving Up {} for {} after {} attempts".format(
+            ",".join(job["pending"]), job["image_fname"], self._retries + 1))
+
+    # spool files ---------------------------------------------------------
+
+    def _job_file(self, job):
+        return os.path.join(self._spool_path, job["id"] + ".json")
+
+    def _save_job(self, job):
+        # with imageStorageMode "none" there is no file to resume from
+        if not self._spool_path or not os.path.exists(job["image_path"]):
+            return
+        tmp_file = self._job_file(job) + ".tmp"
+        try:
+            with open(tmp_file, "w") as file:
+                json.dump(dict((key, value) for key, value in job.items()
+                               if key not in ("data", "outstanding")),
+                          file)
+            os.replace(tmp_file, self._job_file(job))
+        except OSError as err:
+            logging.error("Could Not Spool {} {}".format(job["image_fname"], err))
+
+    def _remove_job(self, job):
+        if not self._spool_path:
+            return
+        try:
+            os.remove(self._job_file(job))
+        except OSError:
+            pass
+
+    def _load_spool(self):
+        files = [os.path.join(self._spool_path, name)
+                 for name in os.listdir(self._spool_path) if name.endswith(".json")]
+        # oldest first so images are delivered in order
+        files.sort(key=os.path.getmtime)
+        for file_name in files:
+            try:
+                with open(file_name) as file:
+                    job = json.load(file)
+            except (OSError, ValueError) as err:
+                logging.error("Bad Spool File {} {}".format(file_name, err))
+                continue
+            # notifiers may have been removed from settings since
+            job["pending"] = [name for name in job["pending"] if name in self._notifiers]
+            if job["pending"] and os.path.exists(job["image_path"]):
+                logging.info("Resume Notification of {}".format(job["image_fname"]))
+                job["resumed"] = True
+                job["attempts"] = 0
+                self._resumed.append(job)
+            else:
+                self._remove_job(job)
@@ -14,14 +14,26 @@
 """
 
 import os
+import io
 import datetime
 import time
 import glob
+import json
+import signal
 import logging
-import picamera
-import picamera.array
 import notifications.FTPUploader as FTPUploader
 import notifications.MSTeamsNontifier as MSTeamsNontifier
+import notifications.NotificationQueue as NotificationQueue
+import storage.ImageIndex as ImageIndex
+import storage.StorageManager as StorageManager
+import storage.ThumbnailCache as ThumbnailCache
+import storage.CloudSync as CloudSync
+import motion.FrameSource as FrameSource
+import motion.ClipRecorder as ClipRecorder
+import motion.MotionEvent as MotionEvent
+import motion.DutyCycleScheduler as DutyCycleScheduler
+import motion.MotionScanner as MotionScanner
+import monitoring.Metrics as Metrics
 if not os.path.exists('settings.py'):
     logging.error(
         """File Not Found - settings.py
@@ -30,6 +42,7 @@ if not os.path.exists('settings.py'):
     exit(1)
 try:
     from settings import *
+    import settings
 except ImportError:
     logging.error("Could Not Import settings.py")
     exit(1)
@@ -42,6 +55,9 @@ SCRIPT_DIR = SCRIPT_PATH[0:SCRIPT_PATH.rfind("/")+1]  # get script directory
 # conversion from stream coordinate to full image coordinate
 X_MO_CONV = imageWidth/float(streamWidth)
 Y_MO_CONV = imageHeight/float(streamHeight)
+imagePath = StorageManager.image_root(imagePath, imageStorageMode, imageTmpfsPath)
+# signals received, see request_stop()
+STOP_SIGNALS = []
 
 # ------------------------------------------------------------------------------
 
@@ -60,7 +76,7 @@ def check_image_dir(image_dir):
 # ------------------------------------------------------------------------------
 
 
-def get_file_name(image_dir, image_name_prefix, current_count):
+def get_file_name(image_dir, image_name_prefix, current_count, taken=()):
     """
     Create a file name based on settings.py variables
     Note image numbering will not be saved but will be inferred from the
@@ -72,7 +88,8 @@ def get_file_name(image_dir, image_name_prefix, current_count):
     or
     Set imageNumOn=False to save images in datetime format to
     ensure image name is unique and avoid overwriting previous image(s).
-
+    A datetime name already in taken (the images of the current event,
+    eventKeyframeSec can be under a second) gets a -1, -2 .. suffix.
     """
     if imageNumOn:
         # you could also use os.path.join to construct image path file_path
@@ -82,13 +99,20 @@ def get_file_name(image_dir, image_name_prefix, current_count):
         file_path = ("{}/{}{:04d}{:02d}{:02d}-{:02d}{:02d}{:02d}.jpg".format(image_dir, image_name_prefix,
                                                                              right_now.year, right_now.month, right_now.day,
                                                                              right_now.hour, right_now.minute, right_now.second))
+        base_path = file_path[:-len(".jpg")]
+        suffix = 1
+        while file_path in taken:
+            file_path = "{}-{}.jpg".format(base_path, suffix)
+            suffix += 1
     return file_path
 
 # ------------------------------------------------------------------------------
 
 
-def get_last_counter():
+def get_last_counter(index=None):
     """
+    Restore the image counter from the image index. If the index has no
+    numbered images fall back to
     glob imagePath for last saved jpg file. Try to extract image counter from
     file name and convert to integer.  If it fails restart number sequence.
 
@@ -100,15 +124,23 @@ def get_last_counter():
     per imageNumOn variable in settings.py
     """
     counter = imageNumStart
+    if imageNumOn and index is not None:
+        last_counter = index.last_counter()
+        if last_counter is not None:
+            counter = last_counter + 1
+            logging.info("Next Image Counter from Index is {}".format(counter))
+            return counter
     if imageNumOn:
         image_ext = ".jpg"
-        search_str = imagePath + "/*" + image_ext
-        file_prefix_len = len(imagePath + imageNamePrefix)+1
+        # include date partition sub folders
+        search_str = imagePath + "/**/*" + image_ext
+        file_prefix_len = len(imageNamePrefix)
         try:
            # Scan image folder for most recent jpg file
            # and try to extract most recent number counter from file name
-            newest = max(glob.iglob(search_str), key=os.path.getctime)
-            count_str = newest[file_prefix_len:newest.find(image_ext)]
+            newest = max(glob.iglob(search_str, recursive=True), key=os.path.getctime)
+            newest_name = os.path.basename(newest)
+            count_str = newest_name[file_prefix_len:newest_name.find(image_ext)]
             logging.info(
                 "Last Saved Image is {} Try to Convert {}".format(newest, count_str))
             counter = int(count_str)+1
@@ -121,95 +153,302 @@ def get_last_counter():
 # ------------------------------------------------------------------------------
 
 
-def save_image(image_path):
+def save_image(session, image_path):
     """
-    Take a photo with the picamera. Note: You may need to increase
-    sleep for low light conditions
+    Take a full resolution photo from the already open camera session.
+    Exposure has settled during session warmup so no sleep is required.
+    With imageInMemory the jpeg is captured into memory and written to
+    image_path from there, or not at all with imageStorageMode "none".
+    Returns a memoryview of the jpeg to hand to the uploaders so they do
+    not read the file back, or None when the camera wrote the file.
     """
-    with picamera.PiCamera() as camera:
-        camera.resolution = (imageWidth, imageHeight)
-        # camera.rotation = cameraRotate
-        # Note use imageVFlip and imageHFlip settings.py variables
-        if imagePreview:
-            camera.start_preview()
-        camera.vflip = imageVFlip
-        camera.hflip = imageHFlip
-        camera.exposure_mode = 'auto'
-        camera.awb_mode = 'auto'
-        time.sleep(0.5)
-        camera.capture(image_path)
-        camera.close()
+    if not imageInMemory and imageStorageMode != "none":
+        session.capture_still(image_path)
+        return None
+    stream = io.BytesIO()
+    session.write_still(stream)
+    data = stream.getbuffer()
+    if imageStorageMode != "none":
+        with open(image_path, "wb") as file:
+            file.write(data)
+    return data
 
 # ------------------------------------------------------------------------------
 
 
-def get_stream_array():
-    """ Take a stream image and return the image data array"""
-    with picamera.PiCamera() as camera:
-        camera.resolution = (streamWidth, streamHeight)
-        with picamera.array.PiRGBArray(camera) as stream:
-            camera.vflip = imageVFlip
-            camera.hflip = imageHFlip
-            camera.exposure_mode = 'auto'
-            camera.awb_mode = 'auto'
-            camera.capture(stream, format='rgb')
-            camera.close()
-            return stream.array
+def scan_pipeline(pipeline, metrics):
+    """
+    MotionScanner.scan_motion for pipelineOn. Frames are compared in the
+    pipeline detector processes. The time from frame capture to its result
+    arriving here is timed as stage "pipeline".
+    """
+    pipeline_time = metrics.stage("pipeline")
+    diff_time = metrics.stage("diff")
+    scanned = metrics.counter("frames_scanned_total", "Stream frames scanned")
+    for frame_time, result, diff_sec in pipeline.results(stop_requested):
+        pipeline_time.observe(time.time() - frame_time)
+        diff_time.observe(diff_sec)
+        scanned.inc()
+        yield result
 
 # ------------------------------------------------------------------------------
 
 
-def scan_motion():
-    """ Loop until motion is detected """
-    data1 = get_stream_array()
-    while True:
-        data2 = get_stream_array()
-        diff_count = 0
-        for y in range(0, streamHeight):
-            for x in range(0, streamWidth):
-                # get pixel differences. Conversion to int
-                # is required to avoid unsigned short overflow.
-                diff = abs(int(data1[y][x][1]) - int(data2[y][x][1]))
-                if diff > threshold:
-                    diff_count += 1
-                    if diff_count > sensitivity:
-                        # x,y is a very rough motion position
-                        return x, y
-        data1 = data2
+def request_stop(signum, frame):
+    """
+    SIGINT (ctrl-c) and SIGTERM (systemctl stop) handler. Only records the
+    signal so the motion loop finishes the current frame and shuts down
+    cleanly. Nothing here takes a lock the interrupted code may hold.
+    A second signal exits at once.
+    """
+    if STOP_SIGNALS:
+        raise KeyboardInterrupt
+    STOP_SIGNALS.append(signum)
+
+
+def stop_requested():
+    return bool(STOP_SIGNALS)
 
 # ------------------------------------------------------------------------------
 
 
-def do_motion_detection():
+def log_event(event, index):
     """
-    Loop until motion found then take an image,
-    and continue motion detection. ctrl-c to exit
+    Log a closed motion event, store it in the image index and
+    append its record to eventLogFile
     """
-    ftp = FTPUploader.FTPUploader(notification_config["ftp"])
-    teams = MSTeamsNontifier.MSTeamsNontifier(notification_config["teams"])
-
-    current_count = get_last_counter()
-    if not imageNumOn:
-        logging.info("File Naming by Date Time Sequence")
-    while True:
-        x_pos, y_pos = scan_motion()
-        file_name = get_file_name(imagePath, imageNamePrefix, current_count)
+    record = event.to_dict(X_MO_CONV, Y_MO_CONV)
+    index.add_event(record, [os.path.relpath(name, imagePath) for name in event.images])
+    logging.info("Motion Event {:.1f} sec {} frames {} images peak {}".format(
+        record["duration"], record["frames"], len(record["images"]),
+        record.get("peak_xy")))
+    if eventLogFile:
+        try:
+            with open(eventLogFile, "a") as file:
+                file.write(json.dumps(record) + "\n")
+        except IOError as err:
+            logging.error("Could Not Write {} {}".format(eventLogFile, err))
 
-        save_image(file_name)
-        image_fname = os.path.basename(file_name)
+# ------------------------------------------------------------------------------
 
-        ftp.upload(file_name, image_fname)
-        teams.notify(
-            "Detected motion", notification_config["teams"]["base_image"] + "/" + image_fname)
 
-        if imageNumOn:
-            current_count += 1
+def do_motion_detection():
+    """
+    Scan frames for motion events. An image is saved for the first
+    keyframes of each event and one record is logged per event.
+    With pipelineOn capture and detection run in their own processes
+    and this process only saves and notifies.
+    ctrl-c to exit
+    """
+    metrics = Metrics.MetricsRegistry()
+    if metricsOn:
+        metrics.start_server(metricsPort, host=metricsHost)
+    if metricsJsonFile:
+        metrics.start_json_dump(metricsJsonFile, metricsJsonSec)
+    index = ImageIndex.ImageIndex(imageIndexFile)
+    if index.count() == 0:
+        # first start with an index, add images saved before
+        index.rebuild(imagePath, imageNamePrefix)
+
+    def on_delivered(image_path, name):
+        if name == "ftp":
+            index.set_uploaded(os.path.relpath(image_path, imagePath))
 
-        # Convert xy movement location for full size image
-        mo_x = x_pos * X_MO_CONV
-        mo_y = y_pos * Y_MO_CONV
-        logging.debug("Motion xy({},{}) Saved {} ({}x{})".format(
-            mo_x, mo_y, file_name, imageWidth, imageHeight,))
+    ftp = FTPUploader.FTPUploader(notification_config["ftp"])
+    # ftp uploads into one folder, the card links the image in its date folder
+    teams = MSTeamsNontifier.MSTeamsNontifier(notification_config["teams"],
+                                              image_root=imagePath)
+    notifier_queue = NotificationQueue.NotificationQueue({"ftp": ftp, "teams": teams},
+                                                         max_size=notifyQueueSize,
+                                                         workers=notifyWorkers,
+                                                         retries=notifyRetries,
+                                                         retry_delay=notifyRetryDelay,
+                                                         drop_policy=notifyDropPolicy,
+                                                         spool_path=notifySpoolPath,
+                                                         on_delivered=on_delivered,
+                                                         metrics=metrics)
+    notifier_queue.start()
+    metrics.gauge("notify_queue_depth", "Images waiting for delivery",
+                  func=notifier_queue.qsize)
+
+    storage = StorageManager.StorageManager(imagePath, layout=storageLayout,
+                                            max_total_mb=storageMaxMB,
+                                            max_age_days=storageMaxDays,
+                                            min_free_mb=storageMinFreeMB,
+                                            index=index)
+    # retention runs on its own thread, the loop only reports new files
+    storage.start()
+    thumbs = ThumbnailCache.ThumbnailCache(imagePath, os.path.join(imagePath, thumbDir),
+                                           size=(thumbWidth, thumbHeight),
+                                           max_mb=thumbMaxMB)
+    if thumbOn:
+        thumbs.start()
+    sync = None
+    if cloudSyncOn and imageStorageMode != "none":
+        sync_manifest = CloudSync.SyncManifest(cloudSyncManifest)
+        sync = CloudSync.CloudSync(imagePath,
+                                   CloudSync.open_remote(cloudSyncRemote,
+                                                         transfers=cloudSyncTransfers),
+                                   sync_manifest,
+                                   batch_size=cloudSyncBatch,
+                                   interval_sec=cloudSyncIntervalSec,
+                                   reconcile_sec=cloudSyncReconcileHours * 3600,
+                                   skip_dirs=(thumbDir,))
+        sync.start()
+    current_count = get_last_counter(index)
+    if not imageNumOn:
+        logging.info("File Naming by Date Time Sequence")
+    clips_on = clipOn
+    if clipOn and imageStorageMode == "none":
+        # clips would be the only thing written to the SD card
+        logging.warning("clipOn Is Not Used With imageStorageMode none")
+        clips_on = False
+    source_args = dict(name=frameSource,
+                       image_size=(imageWidth, imageHeight),
+                       stream_size=(streamWidth, streamHeight),
+                       path=frameSourcePath,
+                       vflip=imageVFlip, hflip=imageHFlip,
+                       preview=imagePreview,
+                       stream_format=streamFormat,
+                       still_video_port=imageUseVideoPort,
+                       clip_sec=clipPreSec + clipPostSec if clips_on else 0,
+                       clip_bitrate=clipBitrate,
+                       lock_exposure=cameraLockExposure,
+                       relock_sec=cameraRelockMin * 60,
+                       fps=frameSourceFps)
+    clip_args = None
+    if clips_on:
+        clip_args = dict(pre_sec=clipPreSec, post_sec=clipPostSec,
+                         ring_frames=clipRingFrames)
+    make_engine, background, lighting = MotionScanner.make_detector(settings)
+    engine = make_engine()
+    tracker = MotionEvent.MotionEventTracker(min_sec=eventMinSec,
+                                             gap_sec=eventGapSec,
+                                             max_images=eventMaxImages,
+                                             keyframe_sec=eventKeyframeSec,
+                                             dropout_sec=eventDropoutSec)
+    clips = None
+    scheduler = None
+    if pipelineOn:
+        # only import the pipeline when it is used, shared memory needs python 3.8
+        import motion.CapturePipeline as CapturePipeline
+        # clips are recorded by the capture process
+        session = CapturePipeline.CapturePipeline(source_args, engine, background,
+                                                  slots=pipelineRingSlots,
+                                                  detectors=pipelineDetectors,
+                                                  clip_args=clip_args,
+                                                  lighting=lighting)
+        if clips_on:
+            clips = session.clip_trigger()
+    else:
+        session = FrameSource.open_frame_source(**source_args)
+        if clips_on:
+            clips = ClipRecorder.ClipRecorder(session, (streamWidth, streamHeight),
+                                              **clip_args)
+        if dutyCycleOn:
+            scheduler = DutyCycleScheduler.DutyCycleScheduler(dutyLevels, session,
+                                                              make_engine,
+                                                              coarse_delta=dutyCoarseDelta,
+                                                              report_sec=dutyReportSec)
+            metrics.gauge("duty_level", "Duty cycle level, 0 = full rate",
+                          func=lambda: scheduler.level)
+            metrics.gauge("effective_fps", "Frames scanned per second",
+                          func=lambda: scheduler.effective_fps)
+    if dutyCycleOn and pipelineOn:
+        logging.warning("dutyCycleOn Is Not Used With pipelineOn")
+    stored = imageStorageMode != "none"
+    if not stored:
+        logging.info("Images Are Not Saved Locally (imageStorageMode none)")
+
+    def add_clips():
+        # clips are written after their image, count them once closed
+        if clips is None:
+            return
+        for clip_path in clips.saved():
+            if stored:
+                storage.add_file(clip_path)
+            if sync is not None:
+                sync.add(clip_path)
+
+    save_time = metrics.stage("save")
+    events = metrics.counter("motion_events_total", "Motion events logged")
+    saved = metrics.counter("images_saved_total", "Images saved")
+    try:
+        with session:
+            if pipelineOn:
+                results = scan_pipeline(session, metrics)
+            else:
+                results = MotionScanner.scan_motion(session.frames(), engine,
+                                                    streamHeight, background, clips,
+                                                    metrics, scheduler, lighting)
+            for result in results:
+                if stop_requested():
+                    break
+                add_clips()
+                save, closed = tracker.update(result)
+                if closed is not None:
+                    log_event(closed, index)
+                    events.inc()
+                if not save:
+                    continue
+                image_dir = storage.partition_dir() if stored else imagePath
+                file_name = get_file_name(image_dir, imageNamePrefix, current_count,
+                                          tracker.event.images)
+
+                if clips is not None:
+                    clips.trigger(file_name)
+                with save_time.time():
+                    data = save_image(session, file_name)
+                saved.inc()
+                tracker.event.add_image(file_name, result)
+                image_fname = os.path.basename(file_name)
+                # Convert movement location for full size image
+                (mo_x, mo_y), mo_box, mo_centre = result.scaled(X_MO_CONV, Y_MO_CONV)
+                if stored:
+                    image_rel_name = os.path.relpath(file_name, imagePath)
+                    thumbs.submit(image_rel_name)
+                    index.add_image(image_rel_name,
+                                    counter=current_count if imageNumOn else None,
+                                    mo_x=mo_x, mo_y=mo_y,
+                                    size=len(data) if data is not None
+                                    else os.path.getsize(file_name))
+                    storage.add_file(file_name)
+                    if sync is not None:
+                        sync.add(file_name)
+
+                # uploads and notifications run in the background and
+                # share the in memory image
+                notifier_queue.submit(file_name, image_fname, data)
+
+                if imageNumOn:
+                    current_count += 1
+
+                logging.debug("Motion xy({},{}) box{} centre{} zones {} Saved {} ({}x{})".format(
+                    mo_x, mo_y, mo_box, mo_centre, result.zone_counts,
+                    file_name, imageWidth, imageHeight,))
+            if stop_requested():
+                logging.warning("Got {}. Stopping".format(signal.Signals(STOP_SIGNALS[0]).name))
+            else:
+                logging.info("No More Frames From {} Source".format(frameSource))
+            if clips is not None:
+                clips.close()
+        # with pipelineOn the last clip is written as the pipeline closes
+        add_clips()
+    finally:
+        closed = tracker.close()
+        if closed is not None:
+            log_event(closed, index)
+            events.inc()
+        # undelivered images stay in the spool for the next start
+        notifier_queue.stop()
+        ftp.close()
+        teams.close()
+        thumbs.stop()
+        storage.stop()
+        if sync is not None:
+            sync.stop()
+            sync_manifest.close()
+        index.close()
 
 
 # Start Main Program Logic
@@ -222,9 +461,10 @@ if __name__ == '__main__':
     # if not verbose:
     #     print("%s WARN  : Messages turned off per settings.py verbose = %s"
     #           % (get_now(), verbose))
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
     try:
         do_motion_detection()
     except KeyboardInterrupt:
-        logging.WARN("")
-        logging.WARN("User Pressed ctrl-c")
-        logging.WARN("Exiting {} {} ".format(PROG_NAME, PROG_VER))
+        logging.warning("Second Stop Signal. Exit Without Clean Up")
+    logging.info("Exiting {} {}".format(PROG_NAME, PROG_VER))
@@ -17,13 +17,129 @@ imageHFlip = True       # Flip image Horizontally
 imagePreview = False    # Set picamera preview False=off True=on
 imageNumOn = False      # Image Naming True=Number sequence  False=DateTime
 imageNumStart = 1000    # Start of number sequence if imageNumOn=True
+storageLayout = "daily"   # imagePath sub folders "daily" YYYY/MM/DD, "hourly" YYYY/MM/DD/HH or "flat"
+storageMaxMB = 0          # delete oldest day/hour folders (flat: files) above this total size. 0 = no limit
+storageMaxDays = 0        # delete folders (flat: files) older than this many days. 0 = keep all
+storageMinFreeMB = 0      # delete oldest folders (flat: files) while disk free space is below this. 0 = Off
+thumbOn = True            # make gallery thumbnails when images are saved (needs python3-pil)
+thumbDir = ".thumbs"      # thumbnail cache folder inside imagePath
+thumbWidth = 160          # max thumbnail width
+thumbHeight = 90          # max thumbnail height
+thumbMaxMB = 50           # least recently used thumbnails are deleted above this size
+imageIndexFile = "images.db"  # sqlite index of saved images and events (used by webserver.py)
+imageUseVideoPort = False # True= instant stills from video port  False= still port (better quality)
+imageInMemory = True      # True= capture into memory, written once and uploaded from memory  False= camera writes file
+imageStorageMode = "disk" # "disk" imagePath, "tmpfs" imageTmpfsPath (RAM, lost on reboot), "none" upload only
+imageTmpfsPath = "/dev/shm/picamera-motion"  # image folder for imageStorageMode "tmpfs"
+
+# Motion Event Settings (one event per incident instead of one image per frame)
+# ---------------------
+eventMinSec = 0.3       # seconds of motion needed before an event starts (debounce)
+eventDropoutSec = 0.1   # frames without motion shorter than this do not cancel a starting event. 0 = any gap cancels
+eventGapSec = 5.0       # seconds without motion that end an event
+eventMaxImages = 5      # max images saved per event
+eventKeyframeSec = 2.0  # min seconds between images of the same event
+eventLogFile = "events.jsonl"  # one json record per event. "" = Off
+
+# Event Clip Settings (frames from before and after each motion trigger)
+# -------------------
+clipOn = False          # True= save a clip with each motion image. Not used with imageStorageMode "none"
+clipPreSec = 3          # seconds before the trigger kept in memory
+clipPostSec = 2         # seconds after the trigger
+clipBitrate = 4000000   # picamera h264 bitrate. Circular buffer memory is about bitrate/8 * seconds
+clipRingFrames = 150    # replay and synthetic sources keep this many stream frames (width*height bytes each)
 
 # User Motion Detection Settings
 # ------------------------------
 threshold = 10  # How Much pixel changes
-sensitivity = 100  # How many pixels change
-streamWidth = 128  # motion scan stream Width
-streamHeight = 80
+sensitivity = 750  # How many pixels change. About 1% of streamWidth x streamHeight, scale it with the stream size
+streamWidth = 320  # motion scan stream Width
+streamHeight = 240 # motion scan stream Height
+streamFormat = "yuv"      # "yuv" compares luma plane only  "rgb" compares green channel
+motionBackgroundOn = False  # True= compare with running average background  False= previous frame
+backgroundAlpha = 0.05      # background learning rate per frame (0.0 - 1.0)
+backgroundStdFactor = 3.0   # per pixel threshold in standard deviations of pixel noise
+backgroundMaxThreshold = 60 # upper limit of per pixel threshold. Lower limit is threshold
+# Motion zones. Empty list [] = whole frame. Coordinates are fractions of the frame
+# Example - ignore the road at the bottom and use a bigger threshold for a tree
+# motionZones = [
+#     {"name": "yard", "rect": (0.0, 0.0, 1.0, 0.8),
+#      "exclude": [{"polygon": [(0.7, 0.0), (1.0, 0.0), (1.0, 0.4)]}]},
+#     {"name": "tree", "polygon": [(0.7, 0.0), (1.0, 0.0), (1.0, 0.4)],
+#      "threshold": 30, "sensitivity": 3000},
+# ]
+motionZones = []
+motionBlockOn = False     # True= count changed pixels per block and need a blob of connected blocks (less noise)
+motionBlockSize = 8       # block width and height in stream pixels
+motionBlockMinPixels = 8  # changed pixels that make a block active
+motionBlobMinBlocks = 2   # connected active blocks needed. Blob changed pixels must also exceed sensitivity
+lightingFilterOn = True   # True= a global lighting change (cloud, lights on) restarts the reference, no event
+lightingMaxShift = 4      # mean brightness change that is checked for lighting (scaling the reference explains it)
+lightingMaxFraction = 0.5 # fraction of pixels changed at once treated as lighting (an object this big is missed)
+cameraLockExposure = True # True= fix shutter, gain and white balance after warmup so the stream does not flicker
+cameraRelockMin = 15      # minutes between exposure re-metering to follow daylight. 0 = never
+frameSource = "picamera"  # Motion frames from "picamera", "replay" or "synthetic"
+frameSourcePath = ""      # replay source folder, .npz or raw file of recorded frames
+frameSourceFps = 30       # replay and synthetic frames per second (event timing needs real time). 0 = max
+pipelineOn = False        # True= capture, detection and saving run in separate processes (multi core Pi)
+pipelineRingSlots = 8     # stream frames kept in shared memory. Oldest is overwritten when detection lags
+pipelineDetectors = 1     # detector processes. Only 1 is used with motionBackgroundOn
+
+# Duty Cycle Settings (scan a quiet scene slower to save cpu, power and heat)
+# -------------------
+dutyCycleOn = False       # True= step down the levels below while nothing moves. Not used with pipelineOn
+dutyLevels = [            # fastest first. Level used after idle_sec quiet seconds
+    {"idle_sec": 0, "fps": 0, "scale": 1},     # fps 0 = as fast as the camera delivers
+    {"idle_sec": 60, "fps": 4, "scale": 1},
+    {"idle_sec": 300, "fps": 2, "scale": 2},   # scale 2 = half stream width and height
+]
+dutyCoarseDelta = 8       # mean brightness change that also returns to full rate
+dutyReportSec = 60        # seconds between effective fps log messages
+
+# Notification Queue Settings (ftp upload and teams notify run in background)
+# --------------------------
+notifyQueueSize = 50             # max images waiting for delivery
+notifyWorkers = 2                # max deliveries running at the same time
+notifyRetries = 3                # retries per notifier after a failed delivery, then kept for next start
+notifyRetryDelay = 2.0           # seconds before first retry. Doubles each retry
+notifyDropPolicy = "drop_oldest" # queue full "block" (wait), "drop_newest" or "drop_oldest"
+notifySpoolPath = "spool"        # folder of pending deliveries kept over restarts. "" = Off
+# notification_config sets up each notifier, eg
+# notification_config = {
+#     "ftp": {"host": "ftp.example.com",  # ftp server name or ip
+#             "port": 21,                 # ftp server port
+#             "username": "pi",
+#             "password": "secret",
+#             "path": "/motion",          # server folder images are uploaded to
+#             "pool_size": 2,             # ftp sessions kept logged in and reused
+#             "keepalive_sec": 30,        # idle sessions are sent NOOP this often. 0 = Off
+#             "timeout": 30},             # seconds to wait on the ftp server
+#     "teams": {"webhook_url": "https://example.webhook.office.com/...",
+#               "base_image": "http://pi:8080",  # url images are linked from
+#               "window_sec": 10,         # merge images within this many seconds into one card. 0 = Off
+#               "max_images": 10,         # most images on one card
+#               "rate_per_min": 4,        # max cards per minute
+#               "rate_burst": 2,          # cards sent at once before rate_per_min applies
+#               "timeout": 30},           # seconds to wait on the webhook
+# }
+
+# Cloud Sync Settings (cloud-sync.py, or cloudSyncOn to upload from picamera-motion.py)
+# -------------------
+cloudSyncOn = False              # True= picamera-motion.py uploads each saved image in the background
+cloudSyncRemote = "rclone:gdmedia:picamera-motion/images"  # "rclone:<name>:<path>" or a local/mounted folder
+cloudSyncManifest = "sync.db"    # sqlite list of files already uploaded
+cloudSyncBatch = 50              # files per upload batch
+cloudSyncTransfers = 4           # files uploaded at the same time
+cloudSyncIntervalSec = 30        # max seconds between upload rounds
+cloudSyncReconcileHours = 24     # hours between full compares with a remote listing
+
+# Metrics Settings (stage latency histograms and counters)
+# ----------------
+metricsOn = False                # True= serve Prometheus metrics on http://<pi>:metricsPort/metrics
+metricsPort = 9110               # local port of the metrics endpoint
+metricsHost = "127.0.0.1"        # "127.0.0.1" this Pi only, "" all interfaces (Prometheus on another computer)
+metricsJsonFile = ""             # json file rewritten every metricsJsonSec seconds. "" = Off
+metricsJsonSec = 60              # seconds between json metric dumps
 
 #======================================
 #       webserver.py Settings
@@ -48,6 +164,7 @@ web_iframe_height = "100%"     # Desired frame height to display images. Scroll
 
 # Right Side Files List
 # ---------------------
+web_thumbnails_on = True         # True= right side thumbnail grid (needs python3-pil)  False= file name list
 web_max_list_entries = 500       # 0 = All or Specify Max right side file entries to show (must be > 1)
 web_list_height = web_image_height  # Right List - side menu height in px (link selection)
 web_list_by_datetime = True      # True=datetime False=filename
@@ -0,0 +1,420 @@
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None   # cloud-sync.py scans the folder instead
+
+
+class SyncManifest:
+    """
+    SQLite list of local files and whether they are on the remote.
+    A file is pending until a transfer of its current size and
+    modification time succeeded, so an interrupted sync resumes where it
+    stopped. path is relative to the synced folder.
+    A failed file waits retry_sec, doubling with every failed attempt up
+    to retry_max_sec, before it is tried again. It is never given up.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            synced INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            synced_at REAL,
+            retry_at REAL NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS files_synced ON files (synced);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value);
+        """
+
+    def __init__(self, db_path, retry_sec=60, retry_max_sec=3600) -> None:
+        self._lock = threading.Lock()
+        self._retry_sec = retry_sec
+        self._retry_max_sec = retry_max_sec
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # picamera-motion.py and cloud-sync.py may both use it
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, path, size, mtime):
+        """ Record a file. Returns True if it is new or changed (now pending) """
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime FROM files WHERE path = ?",
+                                   (path,)).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime:
+                return False
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, synced, attempts, retry_at)"
+                " VALUES (?, ?, ?, 0, 0, 0)", (path, size, mtime))
+            self._db.commit()
+        return True
+
+    def pending(self, limit=100):
+        """ Pending paths due for a try, fewest failed attempts first """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM files WHERE synced = 0 AND retry_at <= ?"
+                " ORDER BY attempts, mtime LIMIT ?", (time.time(), limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def pending_count(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM files WHERE synced = 0").fetchone()[0]
+
+    def mark_synced(self, paths):
+        with self._lock:
+            self._db.executemany("UPDATE files SET synced = 1, synced_at = ? WHERE path = ?",
+                                 [(time.time(), path) for path in paths])
+            self._db.commit()
+
+    def mark_failed(self, paths):
+        """ Count a failed attempt and wait before the next one """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE files SET retry_at = ? + min(?, ? * (1 << min(attempts, 20))),"
+                " attempts = attempts + 1 WHERE path = ?",
+                [(time.time(), self._retry_max_sec, self._retry_sec, path) for path in paths])
+            self._db.commit()
+
+    def mark_pending(self, paths):
+        """ Sync again, eg files found missing on the remote """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE files SET synced = 0, attempts = 0, retry_at = 0 WHERE path = ?",
+                [(path,) for path in paths])
+            self._db.commit()
+
+    def retry_failed(self):
+        """ Make failed files due now. Returns how many there were """
+        with self._lock:
+            count = self._db.execute(
+                "UPDATE files SET attempts = 0, retry_at = 0"
+                " WHERE synced = 0 AND attempts > 0").rowcount
+            self._db.commit()
+        return count
+
+    def get_value(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_value(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             (key, value))
+            self._db.commit()
+
+    def remove(self, paths):
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE path = ?",
+                                 [(path,) for path in paths])
+            self._db.commit()
+
+    def files(self):
+        """ dict of path: (size, mtime, synced) """
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime, synced FROM files").fetchall()
+        return dict((row[0], row[1:]) for row in rows)
+
+
+class LocalRemote:
+    """
+    Remote that is a local or mounted folder (nfs, smb, usb disk).
+    Also a stand in for a cloud remote when trying out the sync.
+    """
+
+    def __init__(self, root, transfers=4) -> None:
+        self._root = root
+        self._transfers = transfers
+
+    def _copy(self, local_root, path):
+        target = os.path.join(self._root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # the remote never has a half copied file
+        tmp_path = target + ".tmp"
+        shutil.copyfile(os.path.join(local_root, path), tmp_path)
+        os.replace(tmp_path, target)
+
+    def upload_batch(self, local_root, paths):
+        """ Copy paths in parallel. Returns the paths that were copied """
+        done = []
+        with ThreadPoolExecutor(max_workers=self._transfers) as pool:
+            futures = [(path, pool.submit(self._copy, local_root, path)) for path in paths]
+            for path, future in futures:
+                try:
+                    future.result()
+                    done.append(path)
+                except OSError as err:
+                    logging.error("Sync Copy of {} Failed {}".format(path, err))
+        return done
+
+    def list(self):
+        """ dict of path: size of every file on the remote """
+        files = {}
+        for root, _, names in os.walk(self._root):
+            for name in names:
+                full_path = os.path.join(root, name)
+                try:
+                    files[os.path.relpath(full_path, self._root)] = os.path.getsize(full_path)
+                except OSError:
+                    pass
+        return files
+
+
+class RcloneRemote:
+    """
+    rclone remote such as "gdmedia:picamera-motion/images".
+    A batch is one rclone copy --files-from call so the remote is never
+    listed to find new files and rclone runs transfers in parallel.
+    """
+
+    def __init__(self, remote, transfers=4, rclone="rclone") -> None:
+        self._remote = remote
+        self._transfers = transfers
+        self._rclone = rclone
+
+    def upload_batch(self, local_root, paths):
+        """ Copy paths with one rclone call. Returns the paths copied """
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as files_from:
+            files_from.write("\n".join(paths) + "\n")
+            files_from.flush()
+            cmd = [self._rclone, "copy", local_root, self._remote,
+                   "--files-from-raw", files_from.name, "--no-traverse",
+                   "--transfers", str(self._transfers)]
+            try:
+                result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, universal_newlines=True)
+            except OSError as err:
+                logging.error("Could Not Run {} {}".format(self._rclone, err))
+                return []
+        if result.returncode != 0:
+            # rclone skips files already copied when the batch is retried
+            logging.error("rclone copy Failed {}".format(result.stdout.strip()[-500:]))
+            return []
+        return list(paths)
+
+    def list(self):
+        cmd = [self._rclone, "lsf", "-R", "--files-only", "--format", "sp",
+               "--separator", "\t", self._remote]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        if result.returncode != 0:
+            raise OSError("rclone lsf Failed {}".format(result.stderr.strip()))
+        files = {}
+        for line in result.stdout.splitlines():
+            size, _, path = line.partition("\t")
+            files[path] = int(size)
+        return files
+
+
+def open_remote(spec, transfers=4):
+    """ "rclone:<remote>:<path>" or a local folder path """
+    if spec.startswith("rclone:"):
+        return RcloneRemote(spec[len("rclone:"):], transfers=transfers)
+    return LocalRemote(spec, transfers=transfers)
+
+
+class CloudSync:
+    """
+    Incremental upload of a local image folder.
+    New files are reported with add() (picamera-motion.py save events or
+    inotify) or found by scan(), which only stats local files. Pending
+    files are pushed in batches by a background thread. reconcile() also
+    lists the remote, queues again files missing there and retries failed
+    files at once. It runs every reconcile_sec seconds. The time of the
+    last reconcile is kept in the manifest so a restart does not list
+    the whole remote again.
+    Local deletions (storage retention) are not mirrored to the remote.
+    """
+
+    def __init__(self, local_root, remote, manifest, batch_size=50,
+                 interval_sec=30, reconcile_sec=86400, min_age_sec=2,
+                 skip_dirs=(".thumbs",)) -> None:
+        self._local_root = local_root
+        self._remote = remote
+        self._manifest = manifest
+        self._batch_size = batch_size
+        self._interval_sec = interval_sec
+        self._reconcile_sec = reconcile_sec
+        self._min_age_sec = min_age_sec
+        self._skip_dirs = skip_dirs
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, file_path):
+        """ Queue a new or changed file (path in or under local_root) """
+        rel_path = os.path.relpath(file_path, self._local_root)
+        parts = rel_path.split(os.sep)
+        if self._skip(parts[-1]) or any(part in self._skip_dirs for part in parts):
+            return
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        if self._manifest.add(rel_path, stat.st_size, stat.st_mtime):
+            self._wake.set()
+
+    def _skip(self, name):
+        return name.startswith(".") or name.endswith(".tmp")
+
+    def scan(self):
+        """
+        Add local files missing from or changed since the manifest and
+        forget deleted ones. Returns the number of files queued.
+        """
+        known = self._manifest.files()
+        now = time.time()
+        queued = 0
+        for root, dirs, names in os.walk(self._local_root):
+            dirs[:] = [name for name in dirs
+                       if name not in self._skip_dirs and not self._skip(name)]
+            for name in names:
+                if self._skip(name):
+                    continue
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, self._local_root)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                entry = known.pop(rel_path, None)
+                if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+                    continue
+                # still being written
+                if now - stat.st_mtime < self._min_age_sec:
+                    continue
+                if self._manifest.add(rel_path, stat.st_size, stat.st_mtime):
+                    queued += 1
+        self._manifest.remove(list(known))
+        return queued
+
+    def reconcile(self):
+        """
+        scan(), queue again synced files missing on the remote and make
+        failed files due now
+        """
+        queued = self.scan()
+        try:
+            remote_files = self._remote.list()
+        except OSError as err:
+            logging.error("Could Not List Remote {}".format(err))
+            return queued
+        missing = [path for path, (size, _, synced) in self._manifest.files().items()
+                   if synced and remote_files.get(path) != size]
+        self._manifest.mark_pending(missing)
+        retried = self._manifest.retry_failed()
+        self._manifest.set_value("last_reconcile", time.time())
+        logging.info("Sync Reconcile {} New, {} Missing on Remote and {} Retried".format(
+            queued, len(missing), retried))
+        return queued + len(missing) + retried
+
+    def sync_once(self):
+        """ Push pending files batch by batch. Returns the number synced """
+        synced = 0
+        while not self._stop.is_set():
+            paths = self._manifest.pending(self._batch_size)
+            if not paths:
+                break
+            done = self._remote.upload_batch(self._local_root, paths)
+            self._manifest.mark_synced(done)
+            failed = sorted(set(paths) - set(done))
+            if failed:
+                self._manifest.mark_failed(failed)
+                break   # try again next round
+            synced += len(done)
+        if synced:
+            logging.info("Synced {} Files. {} Pending".format(
+                synced, self._manifest.pending_count()))
+        return synced
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="cloud-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            since = time.time() - self._manifest.get_value("last_reconcile", 0)
+            # also when the clock was set back (no rtc on a Pi)
+            if not 0 <= since < self._reconcile_sec:
+                self.reconcile()
+            try:
+                self.sync_once()
+            except Exception as err:
+                logging.error("Cloud Sync Failed {}".format(err))
+            self._wake.wait(self._interval_sec)
+            self._wake.clear()
+
+
+class InotifyWatcher:
+    """
+    Call on_file(path) for every file closed after writing or moved in
+    anywhere under root. Date folders created later are watched too.
+    Needs the optional inotify_simple package (pip3 install inotify_simple).
+    """
+
+    def __init__(self, root, on_file, skip_dirs=()) -> None:
+        flags = inotify_simple.flags
+        self._inotify = inotify_simple.INotify()
+        self._mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self._on_file = on_file
+        self._skip_dirs = skip_dirs
+        self._dirs = {}
+        self._watch_tree(root, report=False)
+
+    def _skip_dir(self, name):
+        return name.startswith(".") or name in self._skip_dirs
+
+    def _watch_tree(self, path, report=True):
+        for root, dirs, names in os.walk(path):
+            dirs[:] = [name for name in dirs if not self._skip_dir(name)]
+            self._dirs[self._inotify.add_watch(root, self._mask)] = root
+            if report:
+                # files written before the watch was added
+                for name in names:
+                    self._on_file(os.path.join(root, name))
+
+    def poll(self, timeout_sec):
+        """ Wait up to timeout_sec for events and report them """
+        flags = inotify_simple.flags
+        for event in self._inotify.read(timeout=int(timeout_sec * 1000)):
+            if event.mask & flags.IGNORED:
+                self._dirs.pop(event.wd, None)
+                continue
+            parent = self._dirs.get(event.wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, event.name)
+            if event.mask & flags.ISDIR:
+                if not self._skip_dir(event.name):
+                    self._watch_tree(path)
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                self._on_file(path)
+
+    def close(self):
+        self._inotify.close()
@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+
+class ImageIndex:
+    """
+    SQLite index of saved images and motion events so startup and the web
+    listing do not have to glob and stat every file on the SD card.
+    file_name is the image path relative to the image folder.
+    One connection is shared between threads behind a lock.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY,
+            file_name TEXT UNIQUE NOT NULL,
+            timestamp REAL NOT NULL,
+            counter INTEGER,
+            mo_x INTEGER,
+            mo_y INTEGER,
+            size INTEGER,
+            uploaded INTEGER NOT NULL DEFAULT 0,
+            event_id INTEGER);
+        CREATE INDEX IF NOT EXISTS images_timestamp ON images (timestamp);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            start REAL NOT NULL,
+            end REAL NOT NULL,
+            frames INTEGER,
+            image_count INTEGER,
+            peak_image TEXT,
+            peak_count INTEGER,
+            peak_x INTEGER,
+            peak_y INTEGER);
+        """
+
+    COLUMNS = ("file_name", "timestamp", "counter", "mo_x", "mo_y", "size",
+               "uploaded", "event_id")
+
+    def __init__(self, db_path) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # readers (webserver.py) do not block the detector writing
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add_image(self, file_name, timestamp=None, counter=None, mo_x=None,
+                  mo_y=None, size=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images"
+                " (file_name, timestamp, counter, mo_x, mo_y, size)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (file_name, timestamp, counter, mo_x, mo_y, size))
+            self._db.commit()
+
+    def set_uploaded(self, file_name, uploaded=True):
+        with self._lock:
+            self._db.execute("UPDATE images SET uploaded = ? WHERE file_name = ?",
+                             (int(uploaded), file_name))
+            self._db.commit()
+
+    def delete(self, file_name):
+        """ Remove the row for one image """
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE file_name = ?", (file_name,))
+            self._db.commit()
+
+    def delete_prefix(self, prefix):
+        """ Remove rows for images under a folder prefix eg "2024/01/31/" """
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE file_name LIKE ?",
+                             (prefix.replace("%", "") + "%",))
+            self._db.commit()
+
+    def rename(self, old_name, new_name):
+        with self._lock:
+            self._db.execute("UPDATE images SET file_name = ? WHERE file_name = ?",
+                             (new_name, old_name))
+            self._db.commit()
+
+    def add_event(self, record, file_names):
+        """ Store an event record and link its images (relative file names) """
+        peak_xy = record.get("peak_xy") or (None, None)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO events (start, end, frames, image_count, peak_image,"
+                " peak_count, peak_x, peak_y) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record["start"], record["end"], record["frames"], len(file_names),
+                 record.get("peak_image"), record.get("peak_count"),
+                 peak_xy[0], peak_xy[1]))
+            event_id = cursor.lastrowid
+            self._db.executemany("UPDATE images SET event_id = ? WHERE file_name = ?",
+                                 [(event_id, name) for name in file_names])
+            self._db.commit()
+        return event_id
+
+    def last_counter(self):
+        """ Highest image counter saved, None if no numbered images """
+        with self._lock:
+            row = self._db.execute("SELECT MAX(counter) FROM images").fetchone()
+        return row[0]
+
+    def _where(self, start, end, prefix=None):
+        clauses = []
+        args = []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            args.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            args.append(end)
+        if prefix:
+            clauses.append("file_name LIKE ?")
+            args.append(prefix.replace("%", "") + "%")
+        if not clauses:
+            return "", args
+        return " WHERE " + " AND ".join(clauses), args
+
+    def count(self, start=None, end=None, prefix=None):
+        where, args = self._where(start, end, prefix)
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images" + where, args).fetchone()[0]
+
+    def query(self, start=None, end=None, offset=0, limit=100, descending=True,
+              order="timestamp", prefix=None):
+        """
+        Return a page of image rows (dicts) with start <= timestamp < end,
+        optionally limited to file names starting with prefix.
+        order is "timestamp" or "file_name".
+        """
+        if order not in ("timestamp", "file_name"):
+            raise ValueError("Unknown order {}".format(order))
+        where, args = self._where(start, end, prefix)
+        sql = "SELECT {} FROM images{} ORDER BY {} {} LIMIT ? OFFSET ?".format(
+            ", ".join(self.COLUMNS), where, order, "DESC" if descending else "ASC")
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit, offset]).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def rebuild(self, image_dir, prefix=""):
+        """
+        Index jpg files already in image_dir (walks sub folders).
+        Used once when the index is new so existing images are listed.
+        """
+        counter_re = re.compile("^" + re.escape(prefix) + r"(\d+)\.jpg$")
+        rows = []
+        for root, dirs, files in os.walk(image_dir):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in files:
+                if not name.endswith(".jpg"):
+                    continue
+                full_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                match = counter_re.match(name)
+                counter = int(match.group(1)) if match else None
+                rows.append((os.path.relpath(full_path, image_dir), stat.st_mtime,
+                             counter, stat.st_size))
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO images (file_name, timestamp, counter, size)"
+                " VALUES (?, ?, ?, ?)", rows)
+            self._db.commit()
+        logging.info("Indexed {} Existing Images in {}".format(len(rows), image_dir))
+        return len(rows)
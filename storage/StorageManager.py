@@ -0,0 +1,277 @@
+import os
+import time
+import shutil
+import logging
+import datetime
+import threading
+
+
+def image_root(image_path, storage_mode="disk", tmpfs_path=""):
+    """
+    Folder images are saved in for the settings.py imageStorageMode.
+    "tmpfs" keeps them in tmpfs_path (RAM). The index, thumbnails,
+    retention and webserver.py follow them there.
+    """
+    if storage_mode == "tmpfs":
+        return tmpfs_path
+    return image_path
+
+
+class StorageManager:
+    """
+    Date partitioned image storage with retention.
+    Images are written to root/YYYY/MM/DD (layout "daily") or
+    root/YYYY/MM/DD/HH (layout "hourly"). Layout "flat" keeps the old single
+    folder. Retention removes whole partitions, oldest first, until the
+    total size is under max_total_mb, nothing is older than max_age_days and
+    the disk has min_free_mb free. 0 turns a limit off. The partition being
+    written and the one for the current time are never removed.
+    With max_total_mb partition sizes are scanned once and then kept up to
+    date by add_file() so enforce() does not stat every file each time.
+    Without any limit enforce() does nothing and start() starts no thread.
+    start() runs enforce() every check_sec seconds on a background thread
+    so deleting a partition or listing a large flat folder never stalls
+    the detection loop, which only reports new files with add_file().
+    With layout "flat" the same limits remove single images and clips,
+    oldest modified first, and the newest file is never removed.
+    """
+
+    DEPTH = {"flat": 0, "daily": 3, "hourly": 4}
+    FLAT_EXTENSIONS = (".jpg", ".jpeg", ".h264", ".npz")   # images and clips
+
+    def __init__(self, root, layout="daily", max_total_mb=0, max_age_days=0,
+                 min_free_mb=0, check_sec=60, index=None) -> None:
+        if layout not in self.DEPTH:
+            raise ValueError("Unknown storage layout {}".format(layout))
+        self._root = root
+        self._layout = layout
+        self._max_total = max_total_mb * 1024 * 1024
+        self._max_age_sec = max_age_days * 86400
+        self._min_free = min_free_mb * 1024 * 1024
+        self._check_sec = check_sec
+        self._index = index
+        self._sizes = None
+        self._last_check = 0
+        self._current = None
+        self._lock = threading.Lock()   # partition sizes, shared with the worker
+        self._stop = threading.Event()
+        self._thread = None
+
+    def partition_path(self, when):
+        """ Folder for an image taken at when (datetime) """
+        parts = [self._root]
+        if self._layout != "flat":
+            parts += ["{:04d}".format(when.year), "{:02d}".format(when.month),
+                      "{:02d}".format(when.day)]
+        if self._layout == "hourly":
+            parts.append("{:02d}".format(when.hour))
+        return os.path.join(*parts)
+
+    def partition_dir(self, when=None):
+        """ Folder for an image taken at when (default now), created if needed """
+        if when is None:
+            when = datetime.datetime.now()
+        path = self.partition_path(when)
+        if path != self._current:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._current = path
+        return path
+
+    def partitions(self):
+        """ Partition folders, oldest first. Zero padded names sort by date """
+        depth = self.DEPTH[self._layout]
+        if depth == 0:
+            return []
+        found = [self._root]
+        for _ in range(depth):
+            children = []
+            for path in found:
+                try:
+                    names = sorted(name for name in os.listdir(path) if name.isdigit())
+                except OSError:
+                    continue
+                children += [os.path.join(path, name) for name in names
+                             if os.path.isdir(os.path.join(path, name))]
+            found = children
+        return found
+
+    def partition_time(self, path):
+        """ Time just after the end of a partition """
+        numbers = [int(part) for part in os.path.relpath(path, self._root).split(os.sep)]
+        start = datetime.datetime(*numbers)
+        if self._layout == "hourly":
+            return start + datetime.timedelta(hours=1)
+        return start + datetime.timedelta(days=1)
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _scan_sizes(self):
+        sizes = dict((path, self._dir_size(path)) for path in self.partitions())
+        with self._lock:
+            self._sizes = sizes
+
+    def add_file(self, file_path):
+        """ Count a newly saved file in its partition size """
+        if self._sizes is None:
+            return
+        partition = os.path.dirname(file_path)
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        with self._lock:
+            self._sizes[partition] = self._sizes.get(partition, 0) + size
+
+    def remove_partition(self, path):
+        """ Delete a partition folder, its index rows and empty parents """
+        logging.info("Storage Retention Removing {}".format(path))
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            if self._sizes is not None:
+                self._sizes.pop(path, None)
+        if self._index is not None:
+            self._index.delete_prefix(os.path.relpath(path, self._root) + "/")
+        parent = os.path.dirname(path)
+        while os.path.abspath(parent) != os.path.abspath(self._root):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def _flat_files(self):
+        """ (mtime, path, size) of the files in a flat root, oldest first """
+        files = []
+        for entry in os.scandir(self._root):
+            if not entry.name.lower().endswith(self.FLAT_EXTENSIONS) or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, entry.path, stat.st_size))
+        return sorted(files)
+
+    def remove_file(self, path):
+        """ Delete a flat layout image or clip and its index row """
+        logging.info("Storage Retention Removing {}".format(path))
+        try:
+            os.remove(path)
+        except OSError as err:
+            logging.error("Could Not Remove {} {}".format(path, err))
+        if self._index is not None:
+            self._index.delete(os.path.relpath(path, self._root))
+
+    def _enforce_flat(self):
+        try:
+            files = self._flat_files()
+        except OSError as err:
+            logging.error("Could Not List {} {}".format(self._root, err))
+            return
+        total = sum(size for _, _, size in files)
+        oldest_first = files[:-1]   # the newest may still be written
+        if self._max_age_sec:
+            cutoff = time.time() - self._max_age_sec
+            while oldest_first and oldest_first[0][0] < cutoff:
+                _, path, size = oldest_first.pop(0)
+                self.remove_file(path)
+                total -= size
+        if self._max_total:
+            while oldest_first and total > self._max_total:
+                _, path, size = oldest_first.pop(0)
+                self.remove_file(path)
+                total -= size
+        if self._min_free:
+            while oldest_first and self._free_bytes() < self._min_free:
+                self.remove_file(oldest_first.pop(0)[1])
+
+    def _free_bytes(self):
+        return shutil.disk_usage(self._root).free
+
+    @property
+    def limited(self):
+        """ True when any retention limit is set """
+        return bool(self._max_total or self._max_age_sec or self._min_free)
+
+    def enforce(self, force=False):
+        """
+        Apply the retention limits. Runs at most every check_sec seconds.
+        Without limits nothing is listed or scanned.
+        """
+        if not self.limited:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < self._check_sec:
+            return
+        self._last_check = now
+        if self._layout == "flat":
+            self._enforce_flat()
+        else:
+            self._enforce_partitions()
+        if self._min_free and self._free_bytes() < self._min_free:
+            logging.warning("Storage Free Space Below {} MB".format(
+                self._min_free // (1024 * 1024)))
+
+    def _total_size(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _enforce_partitions(self):
+        # sizes are only needed, and only scanned, for max_total_mb
+        if self._max_total and self._sizes is None:
+            self._scan_sizes()
+        if self._sizes is not None:
+            with self._lock:
+                oldest_first = sorted(self._sizes)
+        else:
+            oldest_first = self.partitions()
+        # also before the first partition_dir() call, eg at startup
+        for keep in set([self._current, self.partition_path(datetime.datetime.now())]):
+            if keep in oldest_first:
+                oldest_first.remove(keep)
+        if self._max_age_sec:
+            cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self._max_age_sec)
+            while oldest_first and self.partition_time(oldest_first[0]) < cutoff:
+                self.remove_partition(oldest_first.pop(0))
+        if self._max_total:
+            while oldest_first and self._total_size() > self._max_total:
+                self.remove_partition(oldest_first.pop(0))
+        if self._min_free:
+            while oldest_first and self._free_bytes() < self._min_free:
+                self.remove_partition(oldest_first.pop(0))
+
+    # background worker ---------------------------------------------------
+
+    def start(self):
+        """ Enforce the limits now and then every check_sec on a worker thread """
+        if not self.limited:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.enforce(force=True)
+            except Exception as err:
+                logging.error("Storage Retention Failed {}".format(err))
+            if self._stop.wait(self._check_sec):
+                return
@@ -0,0 +1,171 @@
+import os
+import time
+import queue
+import logging
+import threading
+try:
+    from PIL import Image
+except ImportError:
+    Image = None   # thumbnails are turned off without Pillow
+
+
+class ThumbnailCache:
+    """
+    Small jpeg thumbnails of saved images in a size limited folder.
+    Thumbnails mirror the image sub folders under cache_dir. The jpeg is
+    decoded with draft() so libjpeg DCT scaling does most of the shrinking
+    without decoding the full size image.
+    When the folder grows past max_mb the least recently used thumbnails
+    are deleted. Use is tracked in the access time, set by get() (the
+    webserver calls it for every thumbnail it serves), so the modification
+    time and the browser cache ETag stay the same.
+    """
+
+    def __init__(self, image_root, cache_dir, size=(160, 90), max_mb=50,
+                 quality=70) -> None:
+        self._image_root = image_root
+        self._cache_dir = cache_dir
+        self._size = size
+        self._max_bytes = max_mb * 1024 * 1024
+        self._quality = quality
+        self._lock = threading.Lock()
+        self._total = None
+        self._queue = None
+        self._thread = None
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def thumb_path(self, file_name):
+        """ Cache path for an image path relative to image_root """
+        return os.path.join(self._cache_dir, file_name)
+
+    @staticmethod
+    def _inside(path, root):
+        """ True when path, with links resolved, is root or under it """
+        real_root = os.path.realpath(root)
+        return os.path.commonpath([os.path.realpath(path), real_root]) == real_root
+
+    def _checked_paths(self, file_name):
+        """
+        (source, thumbnail) paths for file_name, or None when either would
+        be outside image_root or cache_dir (absolute names, .. or links)
+        """
+        source = os.path.join(self._image_root, file_name)
+        path = self.thumb_path(file_name)
+        if (os.path.isabs(file_name) or not self._inside(source, self._image_root)
+                or self._inside(source, self._cache_dir)
+                or not self._inside(path, self._cache_dir)):
+            logging.warning("Thumbnail Name Outside Image Folder {}".format(file_name))
+            return None
+        return source, path
+
+    def get(self, file_name):
+        """ Return the thumbnail path, creating it now if it is missing """
+        paths = self._checked_paths(file_name)
+        if paths is None:
+            return None
+        path = paths[1]
+        if os.path.exists(path):
+            try:
+                # mark as recently used. noatime mounts do not stop this
+                os.utime(path, (time.time(), os.stat(path).st_mtime))
+            except OSError:
+                pass
+            return path
+        return self.create(file_name)
+
+    def create(self, file_name):
+        """ Make the thumbnail of one image. Returns its path or None """
+        if Image is None:
+            return None
+        paths = self._checked_paths(file_name)
+        if paths is None:
+            return None
+        source, path = paths
+        tmp_path = path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with Image.open(source) as image:
+                # pick the jpeg scale factor before decoding
+                image.draft("RGB", self._size)
+                image.thumbnail(self._size)
+                image.convert("RGB").save(tmp_path, "JPEG", quality=self._quality)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except (OSError, IOError) as err:
+            logging.error("Could Not Create Thumbnail of {} {}".format(file_name, err))
+            return None
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+        self.evict()
+        return path
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self._cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        """ Delete least recently used thumbnails above max_mb """
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._scan())
+            if self._total <= self._max_bytes:
+                return
+            files = sorted(self._scan())
+            self._total = sum(size for _, size, _ in files)
+            # go a little under the limit so eviction does not run every save
+            target = self._max_bytes * 0.9
+            for _, size, path in files:
+                if self._total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self._total -= size
+                except OSError:
+                    pass
+
+    # background worker ---------------------------------------------------
+
+    def start(self, max_waiting=100):
+        """ Start the worker thread used by submit() """
+        if Image is None:
+            logging.warning("Pillow Not Installed. Thumbnails Are Off")
+            return
+        self._queue = queue.Queue(maxsize=max_waiting)
+        self._thread = threading.Thread(target=self._run, name="thumbs", daemon=True)
+        self._thread.start()
+
+    def submit(self, file_name):
+        """ Make a thumbnail in the background. Missed ones are made on demand """
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(file_name)
+        except queue.Full:
+            pass
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        self._queue = None
+
+    def _run(self):
+        while True:
+            file_name = self._queue.get()
+            if file_name is None:
+                return
+            self.create(file_name)
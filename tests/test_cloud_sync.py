@@ -0,0 +1,139 @@
+import os
+import time
+import storage.CloudSync as CloudSync
+
+
+class FailingRemote(CloudSync.LocalRemote):
+    """ LocalRemote that fails every upload while down is set """
+
+    def __init__(self, root, fail_after=None) -> None:
+        super().__init__(root, transfers=2)
+        self.down = False
+        self.batches = []
+        self.fail_after = fail_after
+
+    def upload_batch(self, local_root, paths):
+        self.batches.append(list(paths))
+        if self.down:
+            return []
+        if self.fail_after is not None:
+            # killed part way through the batch
+            super().upload_batch(local_root, paths[:self.fail_after])
+            self.fail_after = None
+            raise KeyboardInterrupt
+        return super().upload_batch(local_root, paths)
+
+
+def make_files(root, count, folder="2026/10/16"):
+    paths = []
+    os.makedirs(os.path.join(root, folder), exist_ok=True)
+    old = time.time() - 60
+    for num in range(count):
+        path = os.path.join(folder, "mo-{:03d}.jpg".format(num))
+        with open(os.path.join(root, path), "wb") as file:
+            file.write(b"x" * (num + 1))
+        os.utime(os.path.join(root, path), (old, old))
+        paths.append(path)
+    return paths
+
+
+def make_sync(tmp_path, remote, batch_size=4):
+    local_root = str(tmp_path / "images")
+    os.makedirs(local_root, exist_ok=True)
+    manifest = CloudSync.SyncManifest(str(tmp_path / "sync.db"))
+    sync = CloudSync.CloudSync(local_root, remote, manifest, batch_size=batch_size)
+    return local_root, manifest, sync
+
+
+def test_sync_in_batches(tmp_path):
+    remote = FailingRemote(str(tmp_path / "remote"))
+    local_root, manifest, sync = make_sync(tmp_path, remote)
+    paths = make_files(local_root, 10)
+    os.makedirs(os.path.join(local_root, ".thumbs"))
+    open(os.path.join(local_root, ".thumbs", "mo-000.jpg"), "w").close()
+    assert sync.scan() == 10
+    assert sync.sync_once() == 10
+    assert [len(batch) for batch in remote.batches] == [4, 4, 2]
+    assert sorted(remote.list()) == sorted(paths)
+    assert manifest.pending_count() == 0
+    # nothing new, nothing sent
+    assert sync.scan() == 0
+    assert sync.sync_once() == 0
+    assert len(remote.batches) == 3
+
+
+def test_resume_after_interrupted_batch(tmp_path):
+    remote = FailingRemote(str(tmp_path / "remote"), fail_after=2)
+    local_root, manifest, sync = make_sync(tmp_path, remote)
+    paths = make_files(local_root, 4)
+    sync.scan()
+    try:
+        sync.sync_once()
+    except KeyboardInterrupt:
+        pass
+    assert len(remote.list()) == 2
+    # a new process sends the batch again, nothing is lost
+    manifest.close()
+    manifest = CloudSync.SyncManifest(str(tmp_path / "sync.db"))
+    sync = CloudSync.CloudSync(local_root, remote, manifest, batch_size=4)
+    assert manifest.pending_count() == 4
+    assert sync.sync_once() == 4
+    assert sorted(remote.list()) == sorted(paths)
+    assert manifest.pending_count() == 0
+
+
+def test_failed_files_back_off_and_are_never_given_up(tmp_path):
+    remote = FailingRemote(str(tmp_path / "remote"))
+    local_root, manifest, sync = make_sync(tmp_path, remote)
+    make_files(local_root, 1)
+    sync.scan()
+    remote.down = True
+    assert sync.sync_once() == 0
+    # backing off, not tried again straight away
+    assert manifest.pending(10) == []
+    assert sync.sync_once() == 0
+    assert len(remote.batches) == 1
+    for _ in range(6):
+        manifest.retry_failed()
+        sync.sync_once()
+    remote.down = False
+    assert sync.reconcile() == 1
+    assert sync.sync_once() == 1
+    assert manifest.pending_count() == 0
+
+
+def test_backoff_doubles_up_to_max(tmp_path):
+    manifest = CloudSync.SyncManifest(str(tmp_path / "sync.db"), retry_sec=10,
+                                      retry_max_sec=30)
+    manifest.add("a.jpg", 1, 1.0)
+    waits = []
+    for _ in range(4):
+        start = time.time()
+        manifest.mark_failed(["a.jpg"])
+        retry_at = manifest._db.execute("SELECT retry_at FROM files").fetchone()[0]
+        waits.append(round(retry_at - start))
+    assert waits == [10, 20, 30, 30]
+
+
+def test_reconcile_requeues_files_missing_on_remote(tmp_path):
+    remote = FailingRemote(str(tmp_path / "remote"))
+    local_root, manifest, sync = make_sync(tmp_path, remote)
+    paths = make_files(local_root, 3)
+    sync.scan()
+    sync.sync_once()
+    os.remove(os.path.join(str(tmp_path / "remote"), paths[1]))
+    assert sync.reconcile() == 1
+    assert manifest.pending(10) == [paths[1]]
+    assert sync.sync_once() == 1
+    assert sorted(remote.list()) == sorted(paths)
+
+
+def test_last_reconcile_is_kept_over_restarts(tmp_path):
+    remote = FailingRemote(str(tmp_path / "remote"))
+    local_root, manifest, sync = make_sync(tmp_path, remote)
+    assert manifest.get_value("last_reconcile") is None
+    sync.reconcile()
+    last_reconcile = manifest.get_value("last_reconcile")
+    manifest.close()
+    manifest = CloudSync.SyncManifest(str(tmp_path / "sync.db"))
+    assert manifest.get_value("last_reconcile") == last_reconcile
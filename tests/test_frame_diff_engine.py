@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from motion.FrameDiffEngine import FrameDiffEngine
+
+
+def baseline_scan(data1, data2, threshold, sensitivity):
+    """ The original per pixel scan_motion loop, on single channel frames """
+    height, width = data1.shape
+    diff_count = 0
+    for y in range(0, height):
+        for x in range(0, width):
+            diff = abs(int(data1[y][x]) - int(data2[y][x]))
+            if diff > threshold:
+                diff_count += 1
+                if diff_count > sensitivity:
+                    return x, y
+    return None
+
+
+def random_frames(rng, shape, changed_fraction):
+    data1 = rng.integers(0, 256, shape, dtype=np.uint8)
+    data2 = data1.copy()
+    changed = rng.random(shape) < changed_fraction
+    data2[changed] = rng.integers(0, 256, int(changed.sum()), dtype=np.uint8)
+    return data1, data2
+
+
+@pytest.mark.parametrize("band_rows", [1, 5, 16, 64])
+def test_trigger_position_matches_the_per_pixel_loop(band_rows):
+    rng = np.random.default_rng(band_rows)
+    for _ in range(50):
+        data1, data2 = random_frames(rng, (24, 32), rng.uniform(0, 0.3))
+        threshold = int(rng.integers(0, 60))
+        sensitivity = int(rng.integers(0, 120))
+        engine = FrameDiffEngine(threshold, sensitivity, band_rows=band_rows)
+        result = engine.compare(data1, data2)
+        expected = baseline_scan(data1, data2, threshold, sensitivity)
+        if expected is None:
+            assert result is None
+        else:
+            assert (result.x, result.y) == expected
+
+
+def test_band_exit_reports_the_crossing_pixel_not_the_band_end():
+    data1 = np.zeros((32, 8), dtype=np.uint8)
+    data2 = data1.copy()
+    # three changed pixels in the first band, more further down
+    data2[1, 2] = data2[2, 5] = data2[3, 7] = 200
+    data2[20:, :] = 200
+    engine = FrameDiffEngine(10, 2, band_rows=16)
+    result = engine.compare(data1, data2)
+    assert (result.x, result.y) == (7, 3) == baseline_scan(data1, data2, 10, 2)
+    # the result still covers every changed pixel in the frame
+    assert result.count == 3 + 12 * 8
+    assert result.bbox == (0, 1, 7, 31)
+
+
+def test_count_equal_to_sensitivity_is_not_motion():
+    data1 = np.zeros((16, 16), dtype=np.uint8)
+    data2 = data1.copy()
+    data2[0, :4] = 50
+    assert FrameDiffEngine(10, 4).compare(data1, data2) is None
+    assert FrameDiffEngine(10, 3).compare(data1, data2) is not None
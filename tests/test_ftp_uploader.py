@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+import pytest
+from notifications.FTPUploader import FTPUploader
+
+pytest.importorskip("pyftpdlib")
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+
+class CountingHandler(FTPHandler):
+    """ Counts logins, NOOPs and STORs. Drops the session when asked """
+
+    logins = 0
+    noops = 0
+    stores = 0
+    drop_on = None   # "NOOP" or "STOR"
+
+    def on_login(self, username):
+        CountingHandler.logins += 1
+
+    def ftp_NOOP(self, line):
+        CountingHandler.noops += 1
+        if CountingHandler.drop_on == "NOOP":
+            CountingHandler.drop_on = None
+            self.close()
+            return
+        super().ftp_NOOP(line)
+
+    def ftp_STOR(self, file, mode='w'):
+        if CountingHandler.drop_on == "STOR":
+            CountingHandler.drop_on = None
+            self.close()
+            return
+        CountingHandler.stores += 1
+        return super().ftp_STOR(file, mode)
+
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    """ Local pyftpdlib server. Yields (uploader config, upload folder) """
+    root = tmp_path / "ftp"
+    root.mkdir()
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("pi", "secret", str(root), perm="elradfmw")
+    CountingHandler.authorizer = authorizer
+    CountingHandler.logins = CountingHandler.noops = CountingHandler.stores = 0
+    CountingHandler.drop_on = None
+    server = FTPServer(("127.0.0.1", 0), CountingHandler)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            server.serve_forever(timeout=0.05, blocking=False, handle_exit=False)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    config = {"host": "127.0.0.1", "port": server.address[1], "username": "pi",
+              "password": "secret", "path": "/", "timeout": 5}
+    yield config, str(root)
+    stop.set()
+    thread.join(5)
+    server.close_all()
+
+
+def make_image(tmp_path, name, size=1000):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_session_is_reused(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(config)
+    for num in range(3):
+        path = make_image(tmp_path, "mo-{}.jpg".format(num))
+        uploader.upload(path, os.path.basename(path))
+    uploader.close()
+    assert CountingHandler.logins == 1
+    assert sorted(os.listdir(root)) == ["mo-0.jpg", "mo-1.jpg", "mo-2.jpg"]
+
+
+def test_upload_from_memory(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(config)
+    data = os.urandom(100000)
+    uploader.deliver(str(tmp_path / "not-saved.jpg"), "mem.jpg", data)
+    uploader.close()
+    with open(os.path.join(root, "mem.jpg"), "rb") as file:
+        assert file.read() == data
+
+
+def test_noop_keepalive_after_idle(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(dict(config, keepalive_sec=0.1))
+    path = make_image(tmp_path, "mo-0.jpg")
+    uploader.upload(path, "mo-0.jpg")
+    # the idle session is kept alive in the background
+    time.sleep(0.45)
+    assert CountingHandler.noops >= 2
+    uploader.upload(path, "mo-1.jpg")
+    uploader.close()
+    assert CountingHandler.logins == 1
+
+
+def test_keepalive_off(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(dict(config, keepalive_sec=0))
+    path = make_image(tmp_path, "mo-0.jpg")
+    uploader.upload(path, "mo-0.jpg")
+    time.sleep(0.2)
+    uploader.upload(path, "mo-1.jpg")
+    uploader.close()
+    assert CountingHandler.noops == 0
+    assert CountingHandler.logins == 1
+
+
+def test_reconnect_when_idle_session_was_dropped(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(dict(config, keepalive_sec=0.1))
+    path = make_image(tmp_path, "mo-0.jpg")
+    uploader.upload(path, "mo-0.jpg")
+    CountingHandler.drop_on = "NOOP"
+    # the keepalive finds the broken session and drops it from the pool
+    time.sleep(0.3)
+    assert CountingHandler.drop_on is None
+    uploader.upload(path, "mo-1.jpg")
+    uploader.close()
+    assert CountingHandler.logins == 2
+    assert sorted(os.listdir(root)) == ["mo-0.jpg", "mo-1.jpg"]
+
+
+def test_reconnect_when_server_drops_during_upload(ftp_server, tmp_path):
+    config, root = ftp_server
+    uploader = FTPUploader(config)
+    path = make_image(tmp_path, "mo-0.jpg")
+    uploader.upload(path, "mo-0.jpg")
+    CountingHandler.drop_on = "STOR"
+    uploader.upload(path, "mo-1.jpg")
+    uploader.close()
+    assert CountingHandler.logins == 2
+    assert sorted(os.listdir(root)) == ["mo-0.jpg", "mo-1.jpg"]
@@ -0,0 +1,95 @@
+from motion.FrameDiffEngine import MotionResult
+from motion.MotionEvent import MotionEventTracker
+
+FRAME_SEC = 1 / 30.0
+
+
+def motion(count=100):
+    return MotionResult(10, 10, count, (5, 5, 15, 15), (10, 10), {})
+
+
+def feed(tracker, frames, start=0.0):
+    """
+    Feed results one frame apart, adding an image for every save like
+    picamera-motion.py. Returns (save, closed event) per frame
+    """
+    results = []
+    for num, result in enumerate(frames):
+        save, closed = tracker.update(result, now=start + num * FRAME_SEC)
+        if save:
+            tracker.event.add_image("mo-{}.jpg".format(num), result)
+        results.append((save, closed))
+    return results
+
+
+def test_blip_shorter_than_min_sec_is_not_an_event():
+    tracker = MotionEventTracker(min_sec=0.3, dropout_sec=0.1)
+    feed(tracker, [motion()] * 3 + [None] * 5)
+    assert tracker.state == MotionEventTracker.IDLE
+    assert tracker.event is None
+
+
+def test_short_dropout_while_triggered_keeps_the_event():
+    tracker = MotionEventTracker(min_sec=0.3, dropout_sec=0.1)
+    frames = [motion()] * 4 + [None, None] + [motion()] * 6
+    saves = [save for save, _ in feed(tracker, frames)]
+    assert tracker.state == MotionEventTracker.ACTIVE
+    assert saves.count(True) == 1
+    assert tracker.event.frames == 10
+
+
+def test_any_gap_cancels_without_dropout():
+    tracker = MotionEventTracker(min_sec=0.3, dropout_sec=0)
+    feed(tracker, [motion()] * 4 + [None])
+    assert tracker.state == MotionEventTracker.IDLE
+
+
+def test_event_goes_through_cooldown_and_closes_after_gap():
+    tracker = MotionEventTracker(min_sec=0.1, gap_sec=1.0, max_images=2,
+                                 keyframe_sec=0.2, dropout_sec=0.1)
+    results = feed(tracker, [motion()] * 30)
+    assert tracker.state == MotionEventTracker.ACTIVE
+    # keyframes are spaced out and capped at max_images
+    assert [save for save, _ in results].count(True) == 2
+    save, closed = tracker.update(None, now=1.0)
+    assert tracker.state == MotionEventTracker.COOLDOWN
+    assert not save and closed is None
+    # motion within gap_sec resumes the same event
+    tracker.update(motion(500), now=1.5)
+    assert tracker.state == MotionEventTracker.ACTIVE
+    tracker.update(None, now=1.6)
+    save, closed = tracker.update(None, now=2.6)
+    assert tracker.state == MotionEventTracker.IDLE
+    assert closed is not None
+    assert closed.frames == 31
+    assert closed.peak.count == 500
+
+
+def test_close_returns_only_a_started_event():
+    tracker = MotionEventTracker(min_sec=0.3)
+    tracker.update(motion(), now=0.0)
+    assert tracker.close() is None
+    feed(tracker, [motion()] * 12)
+    assert tracker.close() is not None
+    assert tracker.state == MotionEventTracker.IDLE
+
+
+def test_wall_clock_step_does_not_stall_the_event():
+    tracker = MotionEventTracker(min_sec=0.1, gap_sec=1.0, max_images=5,
+                                 keyframe_sec=0.5, dropout_sec=0.1)
+    saves = 0
+    for num in range(60):
+        # the wall clock steps back an hour half way through
+        wall = 5000.0 + num * FRAME_SEC - (3600 if num >= 30 else 0)
+        save, _ = tracker.update(motion(), now=num * FRAME_SEC, wall=wall)
+        if save:
+            tracker.event.add_image("mo-{}.jpg".format(num), motion())
+            saves += 1
+    assert saves == 4
+    tracker.update(None, now=2.1)
+    _, closed = tracker.update(None, now=3.2)
+    record = closed.to_dict()
+    # the record keeps wall times, the duration is monotonic
+    assert record["start"] == 5000.0
+    assert record["end"] < record["start"]
+    assert record["duration"] == round(59 * FRAME_SEC, 3)
@@ -0,0 +1,75 @@
+import os
+import time
+import notifications.NotificationQueue as NotificationQueue
+
+
+class FakeNotifier:
+    """ Records deliveries and fails for image names in failing """
+
+    def __init__(self, failing=()) -> None:
+        self.failing = set(failing)
+        self.delivered = []
+        self.attempts = 0
+
+    def deliver(self, image_path, image_fname, data=None):
+        self.attempts += 1
+        if image_fname in self.failing:
+            raise IOError("server down")
+        self.delivered.append(image_fname)
+
+
+def make_images(tmp_path, names):
+    paths = []
+    for name in names:
+        path = str(tmp_path / name)
+        open(path, "wb").close()
+        paths.append(path)
+    return paths
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_backing_off_jobs_do_not_hold_the_workers(tmp_path):
+    notifier = FakeNotifier(failing=["bad-1.jpg", "bad-2.jpg"])
+    notify = NotificationQueue.NotificationQueue({"ftp": notifier}, workers=2,
+                                                 retries=3, retry_delay=30.0)
+    notify.start()
+    try:
+        for path in make_images(tmp_path, ["bad-1.jpg", "bad-2.jpg", "good.jpg"]):
+            notify.submit(path, os.path.basename(path))
+        assert wait_for(lambda: notifier.delivered == ["good.jpg"], timeout=2.0)
+    finally:
+        notify.stop()
+
+
+def test_job_failing_every_retry_stays_in_the_spool(tmp_path):
+    spool = str(tmp_path / "spool")
+    notifier = FakeNotifier(failing=["bad.jpg"])
+    notify = NotificationQueue.NotificationQueue({"ftp": notifier}, workers=1,
+                                                 retries=2, retry_delay=0.05,
+                                                 spool_path=spool)
+    notify.start()
+    path = make_images(tmp_path, ["bad.jpg"])[0]
+    notify.submit(path, "bad.jpg")
+    assert wait_for(lambda: notifier.attempts == 3)
+    time.sleep(0.3)
+    notify.stop()
+    assert notifier.attempts == 3
+    assert len(os.listdir(spool)) == 1
+    # delivered with a fresh set of retries on the next start
+    notifier.failing = set()
+    notify = NotificationQueue.NotificationQueue({"ftp": notifier}, workers=1,
+                                                 spool_path=spool)
+    notify.start()
+    try:
+        assert wait_for(lambda: notifier.delivered == ["bad.jpg"])
+        assert wait_for(lambda: os.listdir(spool) == [])
+    finally:
+        notify.stop()
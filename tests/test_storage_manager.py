@@ -0,0 +1,78 @@
+import os
+import time
+import storage.ImageIndex as ImageIndex
+import storage.StorageManager as StorageManager
+
+
+def make_flat_files(root, names, size=1024):
+    """ Files in a flat root, the first name modified longest ago """
+    start = time.time() - 86400 * 10
+    for num, name in enumerate(names):
+        path = os.path.join(root, name)
+        with open(path, "wb") as file:
+            file.write(b"x" * size)
+        os.utime(path, (start + num * 3600, start + num * 3600))
+
+
+def test_flat_layout_removes_oldest_files_above_max_size(tmp_path):
+    root = str(tmp_path / "images")
+    os.makedirs(root)
+    index = ImageIndex.ImageIndex(str(tmp_path / "images.db"))
+    names = ["mo-{}.jpg".format(num) for num in range(4)] + ["mo-3.npz"]
+    make_flat_files(root, names, size=300 * 1024)
+    for name in names[:4]:
+        index.add_image(name)
+    storage = StorageManager.StorageManager(root, layout="flat", max_total_mb=1,
+                                            index=index)
+    storage.enforce(force=True)
+    assert sorted(os.listdir(root)) == ["mo-2.jpg", "mo-3.jpg", "mo-3.npz"]
+    assert index.count() == 2
+    index.close()
+
+
+def test_flat_layout_removes_old_files_but_never_the_newest(tmp_path):
+    root = str(tmp_path)
+    make_flat_files(root, ["mo-0.jpg", "mo-1.jpg"])
+    open(os.path.join(root, "notes.txt"), "w").close()
+    os.utime(os.path.join(root, "notes.txt"), (0, 0))
+    storage = StorageManager.StorageManager(root, layout="flat", max_age_days=1)
+    storage.enforce(force=True)
+    assert sorted(os.listdir(root)) == ["mo-1.jpg", "notes.txt"]
+
+
+def test_worker_removes_old_partitions_in_the_background(tmp_path):
+    root = str(tmp_path)
+    storage = StorageManager.StorageManager(root, max_age_days=1, check_sec=0.05)
+    old = os.path.join(root, "2001", "01", "01")
+    os.makedirs(old)
+    open(os.path.join(old, "mo-0.jpg"), "wb").close()
+    storage.start()
+    try:
+        deadline = time.monotonic() + 5
+        while os.path.exists(os.path.join(root, "2001")) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert not os.path.exists(old)
+        # files saved meanwhile are counted from the detection thread
+        image = os.path.join(storage.partition_dir(), "mo-1.jpg")
+        with open(image, "wb") as file:
+            file.write(b"x" * 10)
+        storage.add_file(image)
+    finally:
+        storage.stop()
+    assert os.path.exists(image)
+
+
+def test_without_limits_nothing_is_scanned(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    make_flat_files(root, ["mo-0.jpg"])
+    for layout in ("flat", "daily"):
+        storage = StorageManager.StorageManager(root, layout=layout)
+        monkeypatch.setattr(storage, "_flat_files", lambda: 1 / 0)
+        monkeypatch.setattr(storage, "_scan_sizes", lambda: 1 / 0)
+        storage.enforce(force=True)
+        storage.start()
+        assert storage._thread is None
+    # max age alone lists partitions but does not size them
+    storage = StorageManager.StorageManager(root, max_age_days=1)
+    monkeypatch.setattr(storage, "_scan_sizes", lambda: 1 / 0)
+    storage.enforce(force=True)
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from notifications.MSTeamsNontifier import MSTeamsNontifier
+from notifications.BurstAggregator import TokenBucket
+import notifications.NotificationQueue as NotificationQueue
+import monitoring.Metrics as Metrics
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """ Teams webhook stand in. Records cards and answers "1" like Teams """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        server.posts.append((time.monotonic(), json.loads(body.decode("utf-8"))))
+        if server.failures:
+            server.failures -= 1
+            self.send_response(429)
+            reply = b"Too Many Requests"
+        else:
+            self.send_response(200)
+            reply = b"1"
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhook():
+    server = HTTPServer(("127.0.0.1", 0), WebhookHandler)
+    server.posts = []
+    server.failures = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05},
+                              daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_notifier(server, **config):
+    config.update(webhook_url="http://127.0.0.1:{}/hook".format(server.server_port),
+                  base_image="http://pi/images", timeout=5)
+    return MSTeamsNontifier(config)
+
+
+def card_images(card):
+    return [image["image"] for image in card["sections"][0]["images"]]
+
+
+def wait_for_posts(server, count, timeout=5.0):
+    end = time.monotonic() + timeout
+    while len(server.posts) < count and time.monotonic() < end:
+        time.sleep(0.02)
+    return [card for _, card in server.posts]
+
+
+def test_burst_is_one_card_with_every_image(webhook):
+    teams = make_notifier(webhook, window_sec=0.3, rate_per_min=60, rate_burst=2)
+    for num in range(3):
+        teams.deliver("images/mo-{}.jpg".format(num), "mo-{}.jpg".format(num))
+    cards = wait_for_posts(webhook, 1)
+    time.sleep(0.3)
+    teams.close()
+    assert len(webhook.posts) == 1
+    assert card_images(cards[0]) == ["http://pi/images/mo-{}.jpg".format(num)
+                                     for num in range(3)]
+    assert "3 images" in cards[0]["text"]
+
+
+def test_token_bucket_spaces_out_cards(webhook):
+    # one card per 0.5 sec after a burst of one
+    teams = make_notifier(webhook, window_sec=0.01, rate_per_min=120, rate_burst=1,
+                          max_images=1)
+    for num in range(3):
+        teams.deliver("images/mo-{}.jpg".format(num), "mo-{}.jpg".format(num))
+    wait_for_posts(webhook, 3)
+    teams.close()
+    times = [post_time for post_time, _ in webhook.posts]
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.4
+    assert times[2] - times[1] >= 0.4
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10.0, burst=2)
+    assert bucket.take() and bucket.take()
+    assert not bucket.take()
+    assert 0 < bucket.wait_time() <= 0.1
+    time.sleep(0.11)
+    assert bucket.take()
+
+
+def test_failed_card_fails_every_image_on_it(webhook):
+    webhook.failures = 1
+    teams = make_notifier(webhook, window_sec=0.2, rate_per_min=600, rate_burst=5)
+    first = teams.deliver("images/mo-0.jpg", "mo-0.jpg")
+    second = teams.deliver("images/mo-1.jpg", "mo-1.jpg")
+    assert isinstance(first.exception(timeout=5), RuntimeError)
+    assert isinstance(second.exception(timeout=5), RuntimeError)
+    third = teams.deliver("images/mo-2.jpg", "mo-2.jpg")
+    assert third.result(timeout=5) is None
+    teams.close()
+    assert [card_images(card) for _, card in webhook.posts] == [
+        ["http://pi/images/mo-0.jpg", "http://pi/images/mo-1.jpg"],
+        ["http://pi/images/mo-2.jpg"]]
+
+
+def test_queue_only_counts_a_card_delivered_once_posted(webhook, tmp_path):
+    webhook.failures = 1
+    spool = str(tmp_path / "spool")
+    image = tmp_path / "mo-0.jpg"
+    image.write_bytes(b"jpeg")
+    metrics = Metrics.MetricsRegistry()
+    delivered = []
+    teams = make_notifier(webhook, window_sec=0.2, rate_per_min=600, rate_burst=5)
+    notify = NotificationQueue.NotificationQueue(
+        {"teams": teams}, retries=1, retry_delay=0.1, spool_path=spool,
+        on_delivered=lambda path, name: delivered.append(name), metrics=metrics)
+    notify.start()
+    try:
+        notify.submit(str(image), "mo-0.jpg")
+        wait_for_posts(webhook, 1)
+        time.sleep(0.1)
+        # the card failed, the job waits in the spool for its retry
+        assert delivered == []
+        assert len(os.listdir(spool)) == 1
+        wait_for_posts(webhook, 2)
+        end = time.monotonic() + 5
+        while os.listdir(spool) and time.monotonic() < end:
+            time.sleep(0.02)
+        assert delivered == ["teams"]
+        assert os.listdir(spool) == []
+    finally:
+        notify.stop()
+        teams.close()
+    failures = metrics.counter("notify_failures_total", "Failed deliveries", notifier="teams")
+    assert failures.value == 1
+
+
+def test_without_window_every_image_is_posted(webhook):
+    teams = make_notifier(webhook, window_sec=0)
+    teams.deliver("images/mo-0.jpg", "mo-0.jpg")
+    webhook.failures = 1
+    with pytest.raises(RuntimeError):
+        teams.deliver("images/mo-1.jpg", "mo-1.jpg")
+    teams.close()
+    assert [card_images(card) for _, card in webhook.posts] == [
+        ["http://pi/images/mo-0.jpg"], ["http://pi/images/mo-1.jpg"]]
+
+
+def test_card_links_the_image_in_its_date_folder(webhook, tmp_path):
+    teams = MSTeamsNontifier(dict(webhook_url="http://127.0.0.1:{}/hook".format(
+        webhook.server_port), base_image="http://pi:8080", window_sec=0),
+        image_root=str(tmp_path))
+    image = os.path.join(str(tmp_path), "2026", "10", "16", "mo-0.jpg")
+    teams.deliver(image, "mo-0.jpg")
+    teams.close()
+    assert card_images(webhook.posts[0][1]) == ["http://pi:8080/2026/10/16/mo-0.jpg"]
@@ -1,18 +1,21 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 
-import cgi
+import html
+import io
 import os
 import socket
-import SocketServer
 import sys
+import threading
 import time
-import urllib
-from SimpleHTTPServer import SimpleHTTPRequestHandler
-from StringIO import StringIO
+import urllib.parse
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from storage.StorageManager import image_root
 
-PROG_VER = "ver 3.4 written by Claude Pageau"
+PROG_VER = "ver 4.0 written by Claude Pageau"
 '''
- SimpleHTTPServer python program to allow selection of images from right panel and display in an iframe left panel
+ Threaded python3 http.server program to allow selection of images from right panel and display in an iframe left panel
  Use for local network use only since this is not guaranteed to be a secure web server.
  based on original code by zeekay and modified by Claude Pageau Nov-2015 for use with pi-timolo.py on a Raspberry Pi
  from http://stackoverflow.com/questions/8044873/python-how-to-override-simplehttpserver-to-show-timestamp-in-directory-listing
@@ -77,47 +80,183 @@ else:
 
 list_title = "%s %s" % (dir_sort, dir_order)
 
+# Root listing comes from the picamera-motion.py sqlite image index when it
+# indexes this web root, so big image folders are not rescanned per request
+image_index = None
+INDEX_FILE_PATH = os.path.join(BASE_DIR, imageIndexFile)
+image_dir = image_root(imagePath, imageStorageMode, imageTmpfsPath)
+if (os.path.exists(INDEX_FILE_PATH) and
+        os.path.abspath(os.path.join(BASE_DIR, image_dir)) == web_root):
+    from storage.ImageIndex import ImageIndex
+    image_index = ImageIndex(INDEX_FILE_PATH)
+
+
+class ListingCache:
+    """
+    Sorted folder listings kept in memory. A listing is rebuilt with
+    os.scandir only when the folder modification time changes, so repeat
+    page loads and auto refresh do not stat every file again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = {}
+
+    def get(self, path):
+        """ Return list of (name, modified time, is_link, is_dir) """
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        entries = []
+        with os.scandir(path) as scan:
+            for entry in scan:
+                if entry.name.startswith("."):
+                    continue   # hidden, eg thumbnail cache
+                try:
+                    modified = entry.stat().st_mtime
+                except OSError:
+                    continue   # removed while listing
+                entries.append((entry.name, modified, entry.is_symlink(), entry.is_dir()))
+        if web_list_by_datetime:
+            # Sort by most recent modified date/time first
+            entries.sort(key=lambda e: e[1], reverse=web_list_sort_descending)
+        else:
+            # Sort by File Name
+            entries.sort(key=lambda e: e[0].lower(), reverse=web_list_sort_descending)
+        with self._lock:
+            self._listings[path] = (mtime, entries)
+        return entries
+
+
+listing_cache = ListingCache()
+
+# Thumbnails of images in the web root, made on first request when the
+# detector has not made them already
+thumbs = None
+if web_thumbnails_on:
+    from storage.ThumbnailCache import ThumbnailCache
+    thumbs = ThumbnailCache(web_root, os.path.join(web_root, thumbDir),
+                            size=(thumbWidth, thumbHeight), max_mb=thumbMaxMB)
+    if not thumbs.available:
+        print("WARN  - Pillow Not Installed. Thumbnails Off. sudo apt-get install python3-pil")
+        thumbs = None
+thumb_url = "/" + thumbDir + "/"
+
+if web_max_list_entries > 1:
+    page_size = web_max_list_entries
+else:
+    page_size = 0   # all entries on one page
+
 class DirectoryHandler(SimpleHTTPRequestHandler):
 
+    def get_page(self):
+        """ Page number from ?page=N in the request url """
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        try:
+            return max(0, int(query.get("page", ["0"])[0]))
+        except ValueError:
+            return 0
+
+    def index_entries(self, page):
+        """ One page of (name, modified time, is_link, is_dir) from the image index """
+        all_entries = image_index.count()
+        rows = image_index.query(offset=page * page_size, limit=page_size or -1,
+                                 descending=web_list_sort_descending,
+                                 order="timestamp" if web_list_by_datetime else "file_name")
+        return [(row["file_name"], row["timestamp"], False, False) for row in rows], all_entries
+
+    def directory_entries(self, path, page):
+        """ One page of (name, modified time, is_link, is_dir) from the folder """
+        entries = listing_cache.get(path)
+        all_entries = len(entries)
+        if page_size:
+            entries = entries[page * page_size:(page + 1) * page_size]
+        return entries, all_entries
+
+    def send_head(self):
+        """
+        Static files get an ETag and Last-Modified header and a 304 Not
+        Modified reply when the browser copy is still current.
+        """
+        self.etag = None
+        path = self.translate_path(self.path)
+        url_path = urllib.parse.unquote(urllib.parse.urlparse(self.path).path)
+        if thumbs is not None and url_path.startswith(thumb_url):
+            # backfill a missing thumbnail or mark it as recently used
+            file_name = os.path.normpath(url_path[len(thumb_url):])
+            if (not os.path.isabs(file_name) and not file_name.startswith("..")
+                    and file_name.lower().endswith(".jpg")):
+                thumbs.get(file_name)
+        if os.path.isdir(path):
+            return super().send_head()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return super().send_head()
+        self.etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+        not_modified = False
+        if "If-None-Match" in self.headers:
+            not_modified = self.etag in [tag.strip() for tag in
+                                         self.headers["If-None-Match"].split(",")]
+        elif "If-Modified-Since" in self.headers:
+            try:
+                since = parsedate_to_datetime(self.headers["If-Modified-Since"])
+                not_modified = int(stat.st_mtime) <= since.timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                pass
+        if not_modified:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+            self.end_headers()
+            return None
+        return super().send_head()
+
+    def end_headers(self):
+        if getattr(self, "etag", None):
+            self.send_header("ETag", self.etag)
+            self.etag = None
+        super().end_headers()
+
     def list_directory(self, path):
+        page = self.get_page()
         try:
-            list = os.listdir(path)
-            all_entries = len(list)
-        except os.error:
+            if image_index is not None and os.path.abspath(path) == web_root:
+                entries, all_entries = self.index_entries(page)
+            else:
+                entries, all_entries = self.directory_entries(path, page)
+        except OSError:
             self.send_error(403, "No permission to list directory")
             return None
 
-        if web_list_by_datetime:
-            # Sort by most recent modified date/time first
-            list.sort(key=lambda x: os.stat(os.path.join(path, x)).st_mtime, reverse=web_list_sort_descending)
-        else:
-            # Sort by File Name
-            list.sort(key=lambda a: a.lower(), reverse=web_list_sort_descending)
-        f = StringIO()
-        displaypath = cgi.escape(urllib.unquote(self.path))
+        f = io.StringIO()
+        url_path = urllib.parse.urlparse(self.path).path
+        displaypath = html.escape(urllib.parse.unquote(url_path))
         # Start HTML formatting code
         f.write('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">')
         f.write('<head>')
         # Setup Meta Tags
-        f.write('<meta "Content-Type" content="txt/html; charset=ISO-8859-1" />')
+        f.write('<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />')
         f.write('<meta name="viewport" content="width=device-width, initial-scale=1.0" />')
         if web_page_refresh_on:
             f.write('<meta http-equiv="refresh" content="%s" />' % web_page_refresh_sec)
         f.write('</head>')
 
-        tpath, cur_folder = os.path.split(self.path)
-        f.write("<html><title>%s %s</title>" % (web_page_title, self.path))
+        tpath, cur_folder = os.path.split(url_path)
+        f.write("<html><title>%s %s</title>" % (web_page_title, url_path))
         f.write("<body>")
         # Start Left iframe Image Panel
         f.write('<iframe width="%s" height="%s" align="left"'
                 % (web_iframe_width_usage, web_image_height))
-        if web_page_blank:
+        # with thumbnails full images are only loaded on click
+        if web_page_blank or not entries or thumbs is not None:
             f.write('src="%s" name="imgbox" id="imgbox" alt="%s">'
                     % ("about:blank", web_page_title))
                     # display second entry in right list since list[0] may still be in progress
         else:
             f.write('src="%s" name="imgbox" id="imgbox" alt="%s">'
-                    % (list[0], web_page_title))
+                    % (urllib.parse.quote(entries[0][0]), web_page_title))
                     # display second entry in right list since list[0] may still be in progress
 
         f.write('<p>iframes are not supported by your browser.</p></iframe>')
@@ -129,33 +268,43 @@ class DirectoryHandler(SimpleHTTPRequestHandler):
         f.write('<ul name="menu" id="menu" style="list-style-type:none; padding-left: 4px">')
         # Create the formatted list of right panel hyperlinks to files in the specified directory
 
-        if not self.path is "/":   # Display folder Back arrow navigation if not in web root
+        if url_path != "/":   # Display folder Back arrow navigation if not in web root
             f.write('<li><a href="%s" >%s</a></li>\n'
-                    % (urllib.quote(".."), cgi.escape("< BACK")))
+                    % (urllib.parse.quote(".."), html.escape("< BACK")))
+        if page > 0:
+            f.write('<li><a href="?page=%i" >%s</a></li>\n'
+                    % (page - 1, html.escape("< PREVIOUS PAGE")))
         display_entries = 0
-        for name in list:
+        for name, modified, is_link, is_dir in entries:
             display_entries += 1
-            if web_max_list_entries > 1:
-                if display_entries >= web_max_list_entries:
-                    break
-            fullname = os.path.join(path, name)
             displayname = linkname = name
-            date_modified = time.strftime('%H:%M:%S %d-%b-%Y', time.localtime(os.path.getmtime(fullname)))
+            date_modified = time.strftime('%H:%M:%S %d-%b-%Y', time.localtime(modified))
             # Append / for directories or @ for symbolic links
-            if os.path.islink(fullname):
+            if is_link:
                 displayname = name + "@"
                 # Note: a link to a directory displays with @ and links with /
-            if os.path.isdir(fullname):
+            if is_dir:
                 # Note this will open a new tab to display the selected folder.
                 displayname = name + "/"
                 linkname = os.path.join(displaypath, displayname)
                 f.write('<li><a href="%s" >%s</a></li>\n'
-                        % (urllib.quote(linkname), cgi.escape(displayname)))
+                        % (urllib.parse.quote(linkname), html.escape(displayname)))
+            elif thumbs is not None and name.lower().endswith(".jpg"):
+                thumb_name = os.path.relpath(os.path.join(path, name), web_root)
+                f.write('<li style="display: inline-block; padding: 2px;">'
+                        '<a href="%s" target="imgbox" title="%s - %s">'
+                        '<img src="%s" loading="lazy" style="max-width: %ipx; max-height: %ipx;" alt="%s"></a></li>\n'
+                        % (urllib.parse.quote(linkname), html.escape(displayname), date_modified,
+                           urllib.parse.quote(thumb_url + thumb_name), thumbWidth, thumbHeight,
+                           html.escape(displayname)))
             else:
                 f.write('<li><a href="%s" target="imgbox">%s</a> - %s</li>\n'
-                        % (urllib.quote(linkname), cgi.escape(displayname), date_modified))
-        if (not self.path is "/") and display_entries > 35:   # Display folder Back arrow navigation if not in web root
-            f.write('<li><a href="%s" >%s</a></li>\n' % (urllib.quote(".."), cgi.escape("< BACK")))
+                        % (urllib.parse.quote(linkname), html.escape(displayname), date_modified))
+        if page_size and (page + 1) * page_size < all_entries:
+            f.write('<li><a href="?page=%i" >%s</a></li>\n'
+                    % (page + 1, html.escape("NEXT PAGE >")))
+        if url_path != "/" and display_entries > 35:   # Display folder Back arrow navigation if not in web root
+            f.write('<li><a href="%s" >%s</a></li>\n' % (urllib.parse.quote(".."), html.escape("< BACK")))
         f.write('</ul></div><p><b>')
         f.write('<div style="float: left; padding-left: 40px;">Web Root is [ %s ]</div>' % web_server_root)
         f.write('<div style="text-align: center;">%s</div>' % web_page_title)
@@ -163,27 +312,26 @@ class DirectoryHandler(SimpleHTTPRequestHandler):
         if web_page_refresh_on:
             f.write('<div style="float: left; padding-left: 40px;">Auto Refresh [ %s sec ]</div>' % web_page_refresh_sec)
 
-        if web_max_list_entries > 1:
-            f.write('<div style="text-align: right; padding-right: 40px;">Listing Only %i of %i Files in [ %s ]</div>'
-                    % (display_entries, all_entries, self.path))
+        if page_size:
+            f.write('<div style="text-align: right; padding-right: 40px;">Listing %i of %i Files (page %i) in [ %s ]</div>'
+                    % (display_entries, all_entries, page + 1, url_path))
         else:
             f.write('<div style="text-align: right; padding-right: 50px;">Listing All %i Files in [ %s ]</div>'
-                    % (all_entries, self.path))
+                    % (all_entries, url_path))
         # Display web refresh info only if setting is turned on
         f.write('</b></p>')
-        length = f.tell()
-        f.seek(0)
+        encoded = f.getvalue().encode("utf-8", "surrogateescape")
         self.send_response(200)
-        encoding = sys.getfilesystemencoding()
-        self.send_header("Content-type", "text/html; charset=%s" % encoding)
-        self.send_header("Content-Length", str(length))
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
         self.end_headers()
-        return f
+        return io.BytesIO(encoded)
 
 # Start Web Server Processing
 os.chdir(web_server_root)
-SocketServer.TCPServer.allow_reuse_address = True
-httpd = SocketServer.TCPServer(("", web_server_port), DirectoryHandler)
+ThreadingHTTPServer.allow_reuse_address = True
+ThreadingHTTPServer.daemon_threads = True  # a slow client never blocks exit
+httpd = ThreadingHTTPServer(("", web_server_port), DirectoryHandler)
 print("----------------------------------------------------------------")
 print("%s %s" % (PROG_NAME, PROG_VER))
 print("---------------------------- Settings --------------------------")
@@ -197,6 +345,7 @@ print("          web_page_refresh_sec = %s  (default=180 sec)" % web_page_refres
 print("          web_page_blank = %s ( True=blank left pane until item selected)" % web_page_blank)
 print("Listing - web_max_list_entries = %s ( 0=all )" % web_max_list_entries)
 print("          web_list_by_datetime = %s  sort_decending = %s" % (web_list_by_datetime, web_list_sort_descending))
+print("          web_thumbnails_on = %s" % (thumbs is not None))
 print("----------------------------------------------------------------")
 print("From a computer on the same LAN. Use a Web Browser to access this server at")
 print("Type the URL below into the browser url bar then hit enter key.")
@@ -214,8 +363,7 @@ except KeyboardInterrupt:
     print("User Pressed ctrl-c")    
     print("%s %s" % (PROG_NAME, PROG_VER))    
     print("Exiting Bye ...")
-    httpd.shutdown()
-    httpd.socket.close()
+    httpd.server_close()
 except IOError as e:
     print("I/O error({0}): {1}".format(e.errno, e.strerror))
 